@@ -0,0 +1,301 @@
+import collections
+import contextlib
+import multiprocessing
+import os
+import struct
+import tarfile
+
+import numpy as np
+
+
+# Name of the archive holding the matrix and spectra of a Defects4J bug
+TAR_FILE = 'gzoltar-files.tar.gz'
+
+# Packed coverage files start with this magic, followed by the number of
+# tests and the number of elements as little-endian unsigned 64-bit ints.
+PACKED_MAGIC = b'FLPACKED'
+PACKED_HEADER = struct.Struct('<8sQQ')
+
+# Byte values of the matrix cells
+ONE = ord('1')
+SPACE = ord(' ')
+
+# PackedCoverage is a container class for a memory mapped packed coverage matrix
+PackedCoverage = collections.namedtuple('PackedCoverage', ('n_tests', 'n_elements', 'rows', 'triggering'))
+
+
+def parse_matrix_row(line, n_elements):
+    """
+    Parse a row of the GZoltar matrix into a coverage vector and its sign
+
+    Rows are fixed-width "0 "/"1 " cells followed by the sign, so the cells
+    are read as every other byte of a uint8 view of the row without
+    splitting it into per-cell objects. Rows which are not fixed-width fall
+    back to splitting on spaces.
+
+    Parameters
+    ----------
+    line : bytes or str
+        a row of the GZoltar matrix, e.g. b"0 1 0 +"
+    n_elements : int
+        the number of code elements each row should indicate coverage for
+
+    Returns
+    -------
+    tuple(numpy.ndarray, bool)
+        the uint8 coverage vector and whether the test failed
+    """
+    row = line.strip()
+    if not isinstance(row, bytes):
+        row = row.encode('ascii')
+    if len(row) == 2 * n_elements + 1:
+        cells = np.frombuffer(row, dtype=np.uint8)
+        if (cells[1::2] == SPACE).all():
+            return (cells[:-1:2] == ONE).view(np.uint8), row[-1:] == b'-'
+    words = row.split(b' ')
+    coverages, sign = words[:-1], words[-1]
+    if len(coverages) != n_elements:
+        raise ValueError("expected {expected} elements in each row, got {actual} in {line!r}".format(expected=n_elements, actual=len(coverages), line=line))
+    return np.array([word == b'1' for word in coverages], dtype=np.uint8), sign == b'-'
+
+
+def write_packed_coverage(matrix_lines, n_elements, output_file):
+    """
+    Write a GZoltar matrix in the packed coverage format.
+
+    The file holds a header with the number of tests and elements, one
+    bit-packed row per test (``ceil(n_elements / 8)`` bytes each) and
+    finally one byte per test which is 1 for failing tests.
+
+    Parameters
+    ----------
+    matrix_lines : iterable
+        the rows of the GZoltar matrix as bytes
+    n_elements : int
+        the number of code elements in the spectra
+    output_file : file
+        a seekable file opened in binary mode
+
+    Returns
+    -------
+    int
+        the number of tests written
+    """
+    output_file.write(PACKED_HEADER.pack(PACKED_MAGIC, 0, n_elements))
+    triggering = bytearray()
+    for line in matrix_lines:
+        if not line.strip():
+            continue
+        coverage, failed = parse_matrix_row(line, n_elements)
+        output_file.write(np.packbits(coverage).tobytes())
+        triggering.append(1 if failed else 0)
+    output_file.write(bytes(triggering))
+    output_file.seek(0)
+    output_file.write(PACKED_HEADER.pack(PACKED_MAGIC, len(triggering), n_elements))
+    output_file.seek(0, 2)
+    return len(triggering)
+
+
+def is_packed_coverage(path):
+    """
+    Check whether a coverage file is in the packed coverage format
+
+    Parameters
+    ----------
+    path : str
+        path to the coverage file
+
+    Returns
+    -------
+    bool
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(PACKED_MAGIC)) == PACKED_MAGIC
+
+
+def load_packed_coverage(path):
+    """
+    Memory map a packed coverage file without reading it
+
+    Parameters
+    ----------
+    path : str
+        path to the coverage file
+
+    Returns
+    -------
+    PackedCoverage
+        ``rows`` is a tests x ceil(elements / 8) uint8 memory map and
+        ``triggering`` a boolean vector which is True for failing tests
+    """
+    with open(path, 'rb') as f:
+        magic, n_tests, n_elements = PACKED_HEADER.unpack(f.read(PACKED_HEADER.size))
+    if magic != PACKED_MAGIC:
+        raise ValueError('{!r} is not a packed coverage file'.format(path))
+    row_bytes = (n_elements + 7) // 8
+    if n_tests == 0:
+        return PackedCoverage(0, n_elements, np.zeros((0, row_bytes), dtype=np.uint8), np.zeros(0, dtype=bool))
+    rows = np.memmap(path, dtype=np.uint8, mode='r', offset=PACKED_HEADER.size, shape=(n_tests, row_bytes))
+    triggering = np.memmap(path, dtype=np.uint8, mode='r', offset=PACKED_HEADER.size + n_tests * row_bytes, shape=(n_tests,))
+    return PackedCoverage(n_tests, n_elements, rows, triggering.view(bool))
+
+
+def find_gzoltar_members(tar):
+    """
+    Walk the members of a gzoltar-files tarball lazily until both the
+    matrix and the spectra have been found, so the rest of the archive is
+    never decompressed
+
+    Parameters
+    ----------
+    tar : tarfile.TarFile
+        the opened tarball
+
+    Returns
+    -------
+    tuple(tarfile.TarInfo, tarfile.TarInfo)
+        the matrix and spectra members, either of which is None if missing
+    """
+    members = dict(walk_gzoltar_members(tar))
+    return members.get('matrix'), members.get('spectra')
+
+
+def walk_gzoltar_members(tar):
+    """
+    Walk the members of a gzoltar-files tarball lazily, yielding the matrix
+    and the spectra as they are reached and stopping once both have been
+    found.
+
+    Works on tarballs opened in stream mode (``'r|*'``), whose current
+    member can be read with ``tar.extractfile`` until the walk resumes.
+
+    Parameters
+    ----------
+    tar : tarfile.TarFile
+        the opened tarball
+
+    Yields
+    ------
+    tuple(str, tarfile.TarInfo)
+        "matrix" or "spectra" and the member, in archive order
+    """
+    found = set()
+    for member in iter(tar.next, None):
+        if not member.isfile():
+            continue
+        kind = 'matrix' if 'matrix' in member.name else ('spectra' if 'spectra' in member.name else None)
+        if kind is None or kind in found:
+            continue
+        found.add(kind)
+        yield kind, member
+        if len(found) == 2:
+            return
+
+
+def is_gzoltar_tarball(path):
+    """
+    Check whether a path points at a Defects4J gzoltar-files tarball
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    bool
+    """
+    return path.endswith(TAR_FILE)
+
+
+def open_gzoltar_tarball(path):
+    """
+    Open a gzoltar-files tarball and locate its matrix and spectra members
+
+    Parameters
+    ----------
+    path : str
+        path to the tarball
+
+    Returns
+    -------
+    tuple(tarfile.TarFile, tarfile.TarInfo, tarfile.TarInfo)
+        the open tarball, which the caller must close, and its matrix and
+        spectra members
+    """
+    tar = tarfile.open(path)
+    matrix, spectra = find_gzoltar_members(tar)
+    if matrix is None or spectra is None:
+        tar.close()
+        raise ValueError('could not find matrix/spectra in {!r}'.format(path))
+    return tar, matrix, spectra
+
+
+@contextlib.contextmanager
+def atomic_open(filename, mode='wb'):
+    """
+    Open a temporary file next to filename which is renamed to filename
+    once it has been written completely, so a partially written file never
+    appears under its final name
+
+    Parameters
+    ----------
+    filename : str
+    mode : str
+        the mode to open the temporary file in
+    """
+    temp_file = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(temp_file, mode) as fwriter:
+            yield fwriter
+        os.rename(temp_file, filename)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def ensure_dir(path):
+    """
+    Create a directory unless it exists, tolerating another process
+    creating it at the same time
+
+    Parameters
+    ----------
+    path : str
+    """
+    if path and not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+
+def map_jobs(worker, jobs, n, initializer=None, initargs=()):
+    """
+    Run a worker over every job, in a pool of n processes if n > 1
+
+    Parameters
+    ----------
+    worker : function
+        a module-level function taking one job
+    jobs : list
+        the jobs
+    n : int
+        the number of processes
+    initializer : function
+        run once in every pool process, with ``initargs``
+    initargs : tuple
+
+    Returns
+    -------
+    list
+        the results of the jobs, in completion order when run in a pool
+    """
+    if n <= 1:
+        return [worker(job) for job in jobs]
+    pool = multiprocessing.Pool(n, initializer=initializer, initargs=initargs)
+    try:
+        return list(pool.imap_unordered(worker, jobs))
+    finally:
+        pool.close()
+        pool.join()
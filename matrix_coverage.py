@@ -1,6 +1,11 @@
 import tarfile
 import os
 import argparse
+import hashlib
+import json
+import shutil
+
+import gzoltar
 
 
 PROJECTS = ['Closure', 'Lang', 'Chart', 'Math', 'Mockito', 'Time']
@@ -12,10 +17,12 @@ PROJECT_BUGS = [
     [str(x) for x in range(1, 39)],
     [str(x) for x in range(1, 28)]
 ]
-TAR_FILE = 'gzoltar-files.tar.gz'
+TAR_FILE = gzoltar.TAR_FILE
+OUTPUT_FORMATS = ['text', 'packed']
+COPY_CHUNK_SIZE = 1 << 20
 
 
-def extract_files(data_dir, output_dir):
+def extract_files(data_dir, output_dir, output_format='text', jobs=1, force=False):
     """
     Extract tar gz files from data directory to get coverage and spectra files
 
@@ -27,69 +34,249 @@ def extract_files(data_dir, output_dir):
     output_dir : str
         the output directory to write coverage and spectra files to
         this directory must exist
+
+    output_format : str
+        "text" to copy the GZoltar matrix verbatim or "packed" to write it
+        in the bit-packed format of ``gzoltar.write_packed_coverage``
+
+    jobs : int
+        number of tarballs to extract in parallel
+
+    force : bool
+        re-extract every bug, even those whose manifest shows the tarball
+        has not changed since it was last extracted
     
     Returns
     -------
-    None
+    tuple(list, list, list)
+        the tarballs that were skipped because they were unchanged, the
+        tarballs that were missing or lacked a matrix/spectra, and
+        (tarball, error) pairs for the tarballs that failed to extract
     """
+    bug_jobs = []
     for project, bugs in zip(PROJECTS, PROJECT_BUGS):
         for bug in bugs:
             tar = os.path.join(data_dir, project, bug, TAR_FILE)
-            coverage, spectra = extract_tar_file(tar)
-            if coverage is None or spectra is None:
-                print('Could not get coverage/spectra for %s' % tar)
-            else:
-                coverage_file = os.path.join(output_dir, '%s-%s-%s' % (project, bug, 'coverage'))
-                spectra_file = os.path.join(output_dir, '%s-%s-%s' % (project, bug, 'spectra'))
-                write_file(coverage_file, coverage)
-                write_file(spectra_file, spectra)
+            coverage_file = os.path.join(output_dir, '%s-%s-%s' % (project, bug, 'coverage'))
+            spectra_file = os.path.join(output_dir, '%s-%s-%s' % (project, bug, 'spectra'))
+            manifest_file = os.path.join(output_dir, '%s-%s-%s' % (project, bug, 'manifest'))
+            bug_jobs.append((tar, coverage_file, spectra_file, manifest_file, output_format, force))
+
+    results = gzoltar.map_jobs(_extract_bug, bug_jobs, jobs)
+
+    skipped = sorted(tar for tar, status, error in results if status == 'skipped')
+    missing = sorted(tar for tar, status, error in results if status == 'missing')
+    failed = sorted((tar, error) for tar, status, error in results if status == 'failed')
+    return skipped, missing, failed
+
+
+def _extract_bug(job):
+    """
+    Pool worker for ``extract_files``
+
+    Returns
+    -------
+    tuple(str, str, str)
+        the tarball, one of "extracted", "skipped", "missing" or "failed",
+        and the error it failed with or None
+    """
+    tar, coverage_file, spectra_file, manifest_file, output_format, force = job
+    if not os.path.exists(tar):
+        return tar, 'missing', None
+    try:
+        outputs_exist = os.path.exists(coverage_file) and os.path.exists(spectra_file)
+        manifest = read_manifest(manifest_file) if outputs_exist and not force else None
+        stat = os.stat(tar)
+        if manifest is not None and manifest['format'] == output_format:
+            if manifest['size'] == stat.st_size and manifest['mtime'] == stat.st_mtime:
+                return tar, 'skipped', None
+            sha1 = hash_file(tar)
+            if manifest['sha1'] == sha1:
+                # Touched but not changed, remember the new mtime
+                write_manifest(manifest_file, tar, stat, sha1, output_format)
+                return tar, 'skipped', None
+        if not extract_tar_file(tar, coverage_file, spectra_file, output_format):
+            return tar, 'missing', None
+        write_manifest(manifest_file, tar, stat, hash_file(tar), output_format)
+        return tar, 'extracted', None
+    except Exception as e:
+        return tar, 'failed', '%s: %s' % (type(e).__name__, e)
+
+
+def hash_file(filename):
+    """
+    Compute the SHA-1 hex digest of a file, reading it in chunks
+
+    Parameters
+    ----------
+    filename : str
+
+    Returns
+    -------
+    str
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as freader:
+        for chunk in iter(lambda: freader.read(COPY_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def read_manifest(manifest_file):
+    """
+    Read the manifest recorded when a bug was last extracted
+
+    Parameters
+    ----------
+    manifest_file : str
+
+    Returns
+    -------
+    dict
+        the size, mtime, sha1 and output format of the source tarball, or
+        None if there is no readable manifest
+    """
+    try:
+        with open(manifest_file) as freader:
+            return json.load(freader)
+    except (IOError, OSError, ValueError):
+        return None
 
 
-def extract_tar_file(tar):
+def write_manifest(manifest_file, tar, stat, sha1, output_format):
     """
-    Extract a tar file and return the matrix and spectra content
+    Record the tarball a bug's coverage and spectra were extracted from
 
     Parameters
     ----------
+    manifest_file : str
     tar : str
         the path to the tarfile
+    stat : os.stat_result
+        the stat of the tarfile taken before it was extracted
+    sha1 : str
+        the SHA-1 hex digest of the tarfile
+    output_format : str
+        the format the coverage matrix was written in
+    """
+    manifest = {
+        'tarball': tar,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha1': sha1,
+        'format': output_format}
+    with gzoltar.atomic_open(manifest_file, 'w') as fwriter:
+        json.dump(manifest, fwriter, sort_keys=True)
+
+
+def extract_tar_file(tar, coverage_file, spectra_file, output_format='text'):
+    """
+    Extract the matrix and spectra of a tar file to the given files
+
+    The tarball is read as a stream and each member is copied when the
+    walk reaches it, so the archive is decompressed once, front to back,
+    and only up to the later of the two members. Packed output needs the
+    number of elements from the spectra, so when the matrix comes first
+    the archive is streamed a second time to pack it. Members are copied in chunks of
+    ``COPY_CHUNK_SIZE`` bytes, so memory use does not depend on the size of
+    the matrix.
+
+    Parameters
+    ----------
+    tar : str
+        the path to the tarfile
+    coverage_file : str
+        the file to write the coverage matrix to
+    spectra_file : str
+        the file to write the spectra to
+    output_format : str
+        "text" or "packed", see ``extract_files``
     
     Returns
-    tuple(str, str)
-        the contents of the coverage matrix and spectra
-    """
-    coverage, spectra = None, None
-    tar = tarfile.open(tar)
-    for member in tar.getmembers():
-        if 'matrix' in member.get_info()['name']:
-            f = tar.extractfile(member)
-            if f is not None:
-                coverage = f.read()
-        if 'spectra' in member.get_info()['name']:
-            f = tar.extractfile(member)
-            if f is not None:
-                spectra = f.read()
-    return coverage, spectra
+    -------
+    bool
+        whether both the matrix and the spectra were found
+    """
+    written = []
+    n_elements = None
+    packed_later = False
+    with tarfile.open(tar, 'r|*') as archive:
+        for kind, member in gzoltar.walk_gzoltar_members(archive):
+            if kind == 'spectra':
+                write_file(spectra_file, archive.extractfile(member))
+                written.append(spectra_file)
+                if output_format == 'packed':
+                    with open(spectra_file, 'rb') as freader:
+                        n_elements = sum(1 for _ in freader)
+            elif output_format != 'packed':
+                write_file(coverage_file, archive.extractfile(member))
+                written.append(coverage_file)
+            elif n_elements is not None:
+                write_packed_file(coverage_file, archive.extractfile(member), n_elements)
+                written.append(coverage_file)
+            else:
+                packed_later = True
+
+    if packed_later and n_elements is not None:
+        with tarfile.open(tar, 'r|*') as archive:
+            for kind, member in gzoltar.walk_gzoltar_members(archive):
+                if kind == 'matrix':
+                    write_packed_file(coverage_file, archive.extractfile(member), n_elements)
+                    written.append(coverage_file)
+                    break
+
+    if len(written) < 2:
+        # Do not leave half of a bug behind
+        for filename in written:
+            os.remove(filename)
+        return False
+    return True
 
 
 def write_file(filename, content):
     """
-    Write content to the given filename
+    Copy content to the given filename in fixed-size chunks
+
+    Parameters
+    ----------
+    filename : str
+    content : file
+        a file object opened in binary mode
+    """
+    with gzoltar.atomic_open(filename) as fwriter:
+        shutil.copyfileobj(content, fwriter, COPY_CHUNK_SIZE)
+
+
+def write_packed_file(filename, coverage, n_elements):
+    """
+    Write a coverage matrix to the given filename in the packed format
 
     Parameters
     ----------
     filename : str
-    content : str
+    coverage : file
+        the GZoltar matrix, opened in binary mode
+    n_elements : int
+        the number of code elements in the spectra
     """
-    with open(filename, 'wb') as fwriter:
-        fwriter.write(content)
+    with gzoltar.atomic_open(filename) as fwriter:
+        gzoltar.write_packed_coverage(coverage, n_elements, fwriter)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--data-dir', required=True, help='data directory that holds data')
     parser.add_argument('--output-dir', required=True, help='file to write coverage and spectra matrices to')
+    parser.add_argument('--format', default='text', choices=OUTPUT_FORMATS, help='format to write coverage matrices in')
+    parser.add_argument('--jobs', type=int, default=1, help='number of tarballs to extract in parallel')
+    parser.add_argument('--force', action='store_true', help='re-extract bugs whose tarball has not changed')
 
     args = parser.parse_args()
     
-    extract_files(args.data_dir, args.output_dir)
+    skipped, missing, failed = extract_files(args.data_dir, args.output_dir, args.format, args.jobs, args.force)
+    if skipped:
+        print('Skipped %d unchanged bugs' % len(skipped))
+    for tar in missing:
+        print('Could not get coverage/spectra for %s' % tar)
+    for tar, error in failed:
+        print('Could not extract %s: %s' % (tar, error))
@@ -1,6 +1,11 @@
 import argparse
+import collections
 import csv
+import json
 import os
+import sys
+
+import gzoltar
 
 
 PROJECTS = ['Closure', 'Lang', 'Chart', 'Math', 'Mockito', 'Time']
@@ -15,6 +20,9 @@ PROJECT_BUGS = [
 SOURCE_CODE_SUFFIX = '.source-code.lines'
 FORMULA = {'barinel', 'dstar2', 'jaccard', 'muse', 'ochiai', 'opt2', 'tarantula'}
 
+# How convert_statement_to_line can merge the values of a line appearing more than once
+LINE_AGGREGATES = ['max', 'mean', 'first']
+
 
 def classname_to_filename(classname):
     """
@@ -53,7 +61,83 @@ def stmt_to_line(statement):
     return '{}#{}'.format(classname_to_filename(classname), line_number)
 
 
-def convert_statement_to_line(source_code_lines_file, statement_suspiciousness, output_file):
+class StatementDictionary(object):
+    """
+    Interns the GZoltar spectra entries of a bug to integer IDs
+
+    Each statement is converted to its line once, when it is first added,
+    with the file name of each class converted once too, so converting it
+    again is a table lookup. A dictionary is meant for a single bug and is
+    shared by all its formulas; it holds every statement of that bug.
+    """
+    def __init__(self):
+        self.ids = dict()
+        self.statements = []
+        self.lines = []
+        self.filenames = dict()
+
+    def __len__(self):
+        return len(self.statements)
+
+    def add(self, statement):
+        """
+        Intern a statement
+
+        Parameters
+        ----------
+        statement : str
+            the statement number along with the classname
+
+        Returns
+        -------
+        int
+            the ID of the statement, its index into ``statements`` and
+            ``lines``
+        """
+        statement_id = self.ids.get(statement)
+        if statement_id is None:
+            classname, line_number = statement.rsplit('#', 1)
+            filename = self.filenames.get(classname)
+            if filename is None:
+                filename = self.filenames[classname] = classname_to_filename(classname)
+            # Only register the statement once it converted
+            line = '{}#{}'.format(filename, line_number)
+            statement_id = self.ids[statement] = len(self.statements)
+            self.statements.append(statement)
+            self.lines.append(line)
+        return statement_id
+
+    def line(self, statement):
+        """
+        Convert statement to line, see ``stmt_to_line``
+
+        Parameters
+        ----------
+        statement : str
+            the statement number along with the classname
+
+        Returns
+        -------
+        str
+            line number in file
+        """
+        return self.lines[self.add(statement)]
+
+
+def read_source_code_lines(source_code_lines_file):
+    """
+    Read the sub-lines of every line from a source-code.lines file
+
+    Parameters
+    ----------
+    source_code_lines_file : str
+        path to the <project>-<bug>b.source-code.lines file
+
+    Returns
+    -------
+    dict
+        line to the list of additional lines that belong to it
+    """
     source_code = dict()
     with open(source_code_lines_file) as f:
         for line in f:
@@ -65,26 +149,273 @@ def convert_statement_to_line(source_code_lines_file, statement_suspiciousness,
             else:
                 source_code[key] = []
                 source_code[key].append(entry[1])
+    return source_code
+
+
+def load_source_code_lines(source_code_lines_file, index_cache=None):
+    """
+    Load the sub-line index of a bug, reusing a persisted copy if possible
+
+    The index is stored in ``index_cache`` as compact JSON along with the
+    size and modification time of the source-code.lines file, and is
+    rebuilt whenever either changed.
+
+    Parameters
+    ----------
+    source_code_lines_file : str
+        path to the <project>-<bug>b.source-code.lines file
+    index_cache : str
+        directory to persist the index in, or None to always parse
+
+    Returns
+    -------
+    dict
+        line to the list of additional lines that belong to it
+    """
+    if index_cache is None:
+        return read_source_code_lines(source_code_lines_file)
+
+    stat = os.stat(source_code_lines_file)
+    index_file = os.path.join(index_cache, os.path.basename(source_code_lines_file) + '.json')
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+        if index['size'] == stat.st_size and index['mtime'] == stat.st_mtime:
+            return index['source_code']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    source_code = read_source_code_lines(source_code_lines_file)
+    gzoltar.ensure_dir(index_cache)
+    with gzoltar.atomic_open(index_file, 'w') as f:
+        json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'source_code': source_code}, f, separators=(',', ':'))
+    return source_code
+
+
+def line_rows(reader, source_code, statements):
+    """
+    Convert the rows of a statement suspiciousness file to line rows
+
+    Parameters
+    ----------
+    reader : csv.DictReader
+        the statement suspiciousness rows
+    source_code : dict
+        the sub-line index of the bug, see ``read_source_code_lines``
+    statements : StatementDictionary
+        the statement dictionary of the bug
+
+    Yields
+    ------
+    tuple(str, str)
+        (line, suspiciousness) for every statement, followed by its sub-lines
+    """
+    for row in reader:
+        line = statements.line(row['Statement'])
+        susps = row['Suspiciousness']
+        yield line, susps
+
+        # check whether there are any sub-lines
+        for additional_line in source_code.get(line, []):
+            yield additional_line, susps
+
+
+def aggregate_lines(rows, aggregate):
+    """
+    Merge the suspiciousness values of lines which appear more than once
+
+    Parameters
+    ----------
+    rows : iterable
+        (line, suspiciousness) pairs, with suspiciousness as read from csv,
+        consumed in a single pass
+    aggregate : str
+        "max" or "mean" of the values of a line, or "first" to keep the
+        value of its first row
+
+    Returns
+    -------
+    list
+        (line, suspiciousness) pairs, one per line in order of first
+        appearance
+    """
+    merged = collections.OrderedDict()
+    if aggregate == 'first':
+        for line, susps in rows:
+            if line not in merged:
+                merged[line] = susps
+    elif aggregate == 'max':
+        for line, susps in rows:
+            value = float(susps)
+            if line not in merged or value > merged[line][0]:
+                merged[line] = (value, susps)
+        return [(line, susps) for line, (_, susps) in merged.items()]
+    elif aggregate == 'mean':
+        for line, susps in rows:
+            total, count = merged.get(line, (0.0, 0))
+            merged[line] = (total + float(susps), count + 1)
+        return [(line, total / count) for line, (total, count) in merged.items()]
+    else:
+        raise ValueError('unrecognized aggregate: {!r}'.format(aggregate))
+    return list(merged.items())
+
+
+def convert_statement_to_line(source_code_lines_file, statement_suspiciousness, output_file, source_code=None,
+                              aggregate=None, statements=None):
+    """
+    Convert a statement suspiciousness file to a line suspiciousness file
+
+    Parameters
+    ----------
+    source_code_lines_file : str
+        path to the <project>-<bug>b.source-code.lines file
+    statement_suspiciousness : str
+        path to the statement suspiciousness file
+    output_file : str
+        path to the line suspiciousness file to write
+    source_code : dict
+        the sub-line index of the bug, if already loaded with
+        ``load_source_code_lines``
+    aggregate : str
+        if given, write every line once with its values merged by
+        ``aggregate_lines``, instead of once per statement or sub-line
+    statements : StatementDictionary
+        the statement dictionary of the bug, if shared with other formulas
+    """
+    if source_code is None:
+        source_code = read_source_code_lines(source_code_lines_file)
+    if statements is None:
+        statements = StatementDictionary()
 
     with open(statement_suspiciousness) as fin:
-        reader = csv.DictReader(fin)
-        with open(output_file, 'w') as f:
+        rows = line_rows(csv.DictReader(fin), source_code, statements)
+        if aggregate is not None:
+            rows = aggregate_lines(rows, aggregate)
+        with gzoltar.atomic_open(output_file, 'w') as f:
             writer = csv.DictWriter(f, ['Line','Suspiciousness'])
             writer.writeheader()
-            for row in reader:
-                line = stmt_to_line(row['Statement'])
-                susps = row['Suspiciousness']
-
+            for line, susps in rows:
                 writer.writerow({
                     'Line': line,
                     'Suspiciousness': susps})
 
-                # check whether there are any sub-lines
-                if line in source_code:
-                    for additional_line in source_code[line]:
-                        writer.writerow({'Line': additional_line, 'Suspiciousness': susps})
-        f.close()
-    fin.close()
+
+def convert_bug(project, bug, formulas, suspiciousness_data_dir, source_code_lines_dir, output_dir, index_cache=None,
+                aggregate=None):
+    """
+    Convert the statement suspiciousness files of a bug for several formulas
+
+    The sub-line index and the statement dictionary of the bug are built
+    once and shared by every formula.
+
+    Parameters
+    ----------
+    project : str
+        the project, eg Closure
+    bug : str
+        the bug number
+    formulas : list
+        the formulas to convert for
+    suspiciousness_data_dir : str
+        directory of the statement suspiciousness files
+    source_code_lines_dir : str
+        directory of the source-code.lines files
+    output_dir : str
+        directory to write the line suspiciousness files to
+    index_cache : str
+        directory to persist sub-line indexes in, see
+        ``load_source_code_lines``
+    aggregate : str
+        how to merge the values of a line, see ``convert_statement_to_line``
+
+    Returns
+    -------
+    list
+        the input files that were missing; the formulas whose statement
+        suspiciousness file is missing are skipped
+    """
+    source_code_lines_file = os.path.join(source_code_lines_dir,
+            '%s-%sb%s' % (project, bug, SOURCE_CODE_SUFFIX))
+    if not os.path.exists(source_code_lines_file):
+        return [source_code_lines_file]
+    source_code = load_source_code_lines(source_code_lines_file, index_cache)
+    statements = StatementDictionary()
+    missing = []
+    for formula in formulas:
+        statement_suspiciousness_file = os.path.join(suspiciousness_data_dir,
+            '%s-%s-%s-suspiciousness' % (project, bug, formula))
+        if not os.path.exists(statement_suspiciousness_file):
+            missing.append(statement_suspiciousness_file)
+            continue
+        output_file = os.path.join(output_dir, '%s-%s-%s-line-suspiciousness' % (project, bug, formula))
+        convert_statement_to_line(source_code_lines_file, statement_suspiciousness_file, output_file, source_code,
+                                  aggregate, statements)
+    return missing
+
+
+def convert_all(formulas, suspiciousness_data_dir, source_code_lines_dir, output_dir, jobs=1, index_cache=None,
+                aggregate=None):
+    """
+    Convert the statement suspiciousness files of every bug
+
+    Every output file is written to a temporary file and renamed once it is
+    complete, so an interrupted run never leaves a truncated file behind. A
+    bug that fails does not abort the run.
+
+    Parameters
+    ----------
+    formulas : list
+        the formulas to convert for
+    suspiciousness_data_dir : str
+        directory of the statement suspiciousness files
+    source_code_lines_dir : str
+        directory of the source-code.lines files
+    output_dir : str
+        directory to write the line suspiciousness files to
+    jobs : int
+        number of bugs to convert in parallel
+    index_cache : str
+        directory to persist sub-line indexes in, see
+        ``load_source_code_lines``
+    aggregate : str
+        how to merge the values of a line, see ``convert_statement_to_line``
+
+    Returns
+    -------
+    tuple(list, list)
+        the input files that were missing, and (bug, error) pairs for the
+        bugs that failed to convert
+    """
+    bug_jobs = []
+    for project, bugs in zip(PROJECTS, PROJECT_BUGS):
+        for bug in bugs:
+            bug_jobs.append((project, bug, formulas, suspiciousness_data_dir, source_code_lines_dir, output_dir,
+                             index_cache, aggregate))
+
+    results = gzoltar.map_jobs(_convert_bug, bug_jobs, jobs)
+
+    missing = sorted(path for _, bug_missing, _ in results for path in bug_missing)
+    failed = sorted((bug, error) for bug, _, error in results if error is not None)
+    return missing, failed
+
+
+def _convert_bug(job):
+    """
+    Pool worker for ``convert_all``
+
+    Returns
+    -------
+    tuple(str, list, str)
+        the bug, the input files that were missing, and the error it failed
+        with or None
+    """
+    project, bug, formulas, suspiciousness_data_dir, source_code_lines_dir, output_dir, index_cache, aggregate = job
+    try:
+        missing = convert_bug(project, bug, formulas, suspiciousness_data_dir, source_code_lines_dir, output_dir,
+                              index_cache=index_cache, aggregate=aggregate)
+    except Exception as e:
+        return '%s-%s' % (project, bug), [], '%s: %s' % (type(e).__name__, e)
+    return '%s-%s' % (project, bug), missing, None
 
 
 if __name__ == '__main__':
@@ -93,21 +424,20 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--source-code-lines', required=True, help='Source code lines directory')
     parser.add_argument('-o', '--output-dir', required=True, help='Output directory')
     parser.add_argument('-f', '--formula', choices=FORMULA, required=False, help='Formula to convert for')
+    parser.add_argument('--index-cache', help='directory to persist the parsed source-code.lines index of each bug in')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of bugs to convert in parallel')
+    parser.add_argument('-a', '--aggregate', choices=LINE_AGGREGATES, required=False, help='Write each line once, merging duplicate values with max, mean or the first value')
 
     args = parser.parse_args()
 
-    for project, bugs in zip(PROJECTS, PROJECT_BUGS):
-        for bug in bugs:
-            source_code_lines_file = os.path.join(args.source_code_lines, 
-                    '%s-%sb%s' % (project, bug, SOURCE_CODE_SUFFIX))
-            if args.formula == None:
-                for key in FORMULA:
-                    statement_suspiciousness_file = os.path.join(args.suspiciousness_data_dir, 
-                        '%s-%s-%s-suspiciousness' % (project, bug, key))
-                    output_file = os.path.join(args.output_dir, '%s-%s-%s-line-suspiciousness' % (project, bug, key))
-                    convert_statement_to_line(source_code_lines_file, statement_suspiciousness_file, output_file)
-            else:
-                statement_suspiciousness_file = os.path.join(args.suspiciousness_data_dir, 
-                        '%s-%s-%s-suspiciousness' % (project, bug, args.formula))
-                output_file = os.path.join(args.output_dir, '%s-%s-%s-line-suspiciousness' % (project, bug, args.formula))
-                convert_statement_to_line(source_code_lines_file, statement_suspiciousness_file, output_file)
+    formulas = FORMULA if args.formula == None else [args.formula]
+    missing, failed = convert_all(formulas, args.suspiciousness_data_dir, args.source_code_lines, args.output_dir,
+                                  jobs=args.jobs, index_cache=args.index_cache, aggregate=args.aggregate)
+    if missing:
+        print('Skipped %d missing input files:' % len(missing))
+        for path in missing:
+            print('  %s' % path)
+    for bug, error in failed:
+        print('Could not convert %s: %s' % (bug, error))
+    if failed:
+        sys.exit(-1)
@@ -2,13 +2,23 @@ from __future__ import division
 from __future__ import print_function
 from glob import glob
 
+import ast
 import collections
+import hashlib
+import io
+import json
 import re
 import argparse
 import csv
 import os
 import sys
 
+import numpy as np
+
+import gzoltar
+import matrix_coverage
+import s2l_suspiciousness
+
 
 def eprint(*args, **kwargs):
     """
@@ -432,6 +442,371 @@ HYBRID_NUMERATOR_FORMULAS = {
 }
 
 
+def tarantula_array(passed, failed, totalpassed, totalfailed):
+    """
+    Vectorized ``tarantula`` over arrays of per-element ``passed`` and
+    ``failed`` counts.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Tarantula suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    if totalpassed == 0 or totalfailed == 0:
+        return np.zeros(passed.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = (failed/totalfailed)/(failed/totalfailed + passed/totalpassed)
+    return np.where(passed+failed == 0, 0., value)
+
+
+def tarantula_hybrid_numerator_array(passed, failed, totalpassed, totalfailed, was_covered):
+    """
+    Vectorized ``tarantula_hybrid_numerator``; ``was_covered`` is a boolean
+    array.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Tarantula hybrid suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    if totalpassed == 0 or totalfailed == 0:
+        return np.zeros(passed.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = (passed/totalpassed + np.asarray(was_covered, dtype=np.int64)/(passed/totalpassed + failed/totalfailed))
+    return np.where(passed+failed == 0, 0., value)
+
+
+def ochiai_array(passed, failed, totalpassed, totalfailed):
+    """
+    Vectorized ``ochiai``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Ochiai suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    if totalfailed == 0:
+        return np.zeros(passed.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = failed/(totalfailed*(failed+passed))**0.5
+    return np.where(passed+failed == 0, 0., value)
+
+
+def ochiai_hybrid_numerator_array(passed, failed, totalpassed, totalfailed, was_covered):
+    """
+    Vectorized ``ochiai_hybrid_numerator``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Ochiai hybrid suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    if totalfailed == 0:
+        return np.zeros(passed.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = (failed + np.asarray(was_covered, dtype=np.int64))/(totalfailed*(failed+passed))**0.5
+    return np.where(passed+failed == 0, 0., value)
+
+
+def opt2_array(passed, failed, totalpassed, totalfailed):
+    """
+    Vectorized ``opt2``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Opt2 suspiciousness value of every element
+    """
+    return np.asarray(failed) - np.asarray(passed)/(totalpassed+1)
+
+
+def opt2_hybrid_numerator_array(passed, failed, totalpassed, totalfailed, was_covered):
+    """
+    Vectorized ``opt2_hybrid_numerator``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Opt2 hybrid suspiciousness value of every element
+    """
+    return np.asarray(failed) - (np.asarray(passed)-np.asarray(was_covered, dtype=np.int64))/(totalpassed+1)
+
+
+def barinel_array(passed, failed, totalpassed, totalfailed):
+    """
+    Vectorized ``barinel``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Barinel suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h = passed/(passed+failed)
+    return np.where(failed == 0, 0., 1-h)
+
+
+def barinel_hybrid_numerator_array(passed, failed, totalpassed, totalfailed, was_covered):
+    """
+    Vectorized ``barinel_hybrid_numerator``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Barinel hybrid suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h = (passed - np.asarray(was_covered, dtype=np.int64))/(passed+failed)
+    return np.where(failed == 0, 0., 1-h)
+
+
+def dstar2_array(passed, failed, totalpassed, totalfailed):
+    """
+    Vectorized ``dstar2``. Elements with a zero denominator get the same
+    ``totalfailed**2 + 1`` sentinel as the scalar version.
+
+    Returns
+    -------
+    numpy.ndarray
+        the dstar2 suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    denominator = passed + totalfailed - failed
+    sentinel = denominator == 0
+    assert np.all(passed[sentinel] == 0) and np.all(failed[sentinel] == totalfailed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = failed**2 / denominator
+    return np.where(sentinel, totalfailed**2 + 1, value) # slightly higher than otherwise possible
+
+
+def dstar2_hybrid_numerator_array(passed, failed, totalpassed, totalfailed, was_covered):
+    """
+    Vectorized ``dstar2_hybrid_numerator``, with the ``totalfailed**2 + 2``
+    sentinel.
+
+    Returns
+    -------
+    numpy.ndarray
+        the dstar2 hybrid suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    denominator = passed + totalfailed - failed
+    sentinel = denominator == 0
+    assert np.all(passed[sentinel] == 0) and np.all(failed[sentinel] == totalfailed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = (failed**2 + np.asarray(was_covered, dtype=np.int64)) / denominator
+    return np.where(sentinel, totalfailed**2 + 2, value) # slightly higher than otherwise possible
+
+
+def muse_array(passed, failed, totalpassed, totalfailed):
+    """
+    Vectorized ``muse``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the MUSE suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    if totalpassed == 0:
+        return np.zeros(passed.shape)
+    return failed - totalfailed/totalpassed * passed
+
+
+def muse_hybrid_numerator_array(passed, failed, totalpassed, totalfailed, was_covered):
+    """
+    Vectorized ``muse_hybrid_numerator``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the MUSE hybrid suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    if totalpassed == 0:
+        return np.zeros(passed.shape)
+    return failed - (totalfailed-np.asarray(was_covered, dtype=np.int64))/totalpassed * passed
+
+
+def jaccard_array(passed, failed, totalpassed, totalfailed):
+    """
+    Vectorized ``jaccard``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Jaccard suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    denominator = totalfailed + passed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = failed / denominator
+    return np.where(denominator == 0, failed, value)
+
+
+def jaccard_hybrid_numerator_array(passed, failed, totalpassed, totalfailed, was_covered):
+    """
+    Vectorized ``jaccard_hybrid_numerator``.
+
+    Returns
+    -------
+    numpy.ndarray
+        the Jaccard hybrid suspiciousness value of every element
+    """
+    passed, failed = np.asarray(passed), np.asarray(failed)
+    numerator = failed + np.asarray(was_covered, dtype=np.int64)
+    denominator = totalfailed + passed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = numerator / denominator
+    return np.where(denominator == 0, numerator, value)
+
+
+# Formula to vectorized function
+VECTORIZED_FORMULAS = {
+    'tarantula': tarantula_array,
+    'ochiai': ochiai_array,
+    'opt2': opt2_array,
+    'barinel': barinel_array,
+    'dstar2': dstar2_array,
+    'muse': muse_array,
+    'jaccard': jaccard_array
+}
+
+# Hybrid formula to vectorized function
+VECTORIZED_HYBRID_NUMERATOR_FORMULAS = {
+    'tarantula': tarantula_hybrid_numerator_array,
+    'ochiai': ochiai_hybrid_numerator_array,
+    'opt2': opt2_hybrid_numerator_array,
+    'barinel': barinel_hybrid_numerator_array,
+    'dstar2': dstar2_hybrid_numerator_array,
+    'muse': muse_hybrid_numerator_array,
+    'jaccard': jaccard_hybrid_numerator_array
+}
+
+# Names a formula expression may refer to, besides the four counts
+EXPRESSION_FUNCTIONS = {
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'exp': np.exp,
+    'abs': np.abs,
+    'minimum': np.minimum,
+    'maximum': np.maximum
+}
+EXPRESSION_VARIABLES = ('passed', 'failed', 'totalpassed', 'totalfailed')
+EXPRESSION_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+
+
+def compile_expression(expression):
+    """
+    Compiles an arithmetic expression over ``passed``, ``failed``,
+    ``totalpassed`` and ``totalfailed`` into a code object, rejecting
+    anything but numbers, those names, arithmetic and ``EXPRESSION_FUNCTIONS``.
+
+    Parameters
+    ----------
+    expression : str
+        e.g. "failed / sqrt(totalfailed * (failed + passed))"
+
+    Returns
+    -------
+    code
+    """
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPRESSION_NODES):
+            raise ValueError('unsupported syntax {} in formula {!r}'.format(type(node).__name__, expression))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError('unsupported constant {!r} in formula {!r}'.format(node.value, expression))
+        if isinstance(node, ast.Name) and node.id not in EXPRESSION_VARIABLES and node.id not in EXPRESSION_FUNCTIONS:
+            raise ValueError('unknown name {!r} in formula {!r}'.format(node.id, expression))
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in EXPRESSION_FUNCTIONS):
+            raise ValueError('unsupported call in formula {!r}'.format(expression))
+    return compile(tree, '<formula>', 'eval')
+
+
+def compile_formula(expression, fallback='0'):
+    """
+    Compiles a formula expression into a vectorized kernel with the same
+    signature as the functions in ``VECTORIZED_FORMULAS``.
+
+    Elements for which the expression is not finite (a division by zero)
+    get the value of the ``fallback`` expression instead.
+
+    Parameters
+    ----------
+    expression : str
+        the suspiciousness formula, see ``compile_expression``
+    fallback : str
+        the value for elements where the formula divides by zero, which may
+        itself be an expression such as "failed"
+
+    Returns
+    -------
+    function
+    """
+    code = compile_expression(expression)
+    fallback_code = compile_expression(str(fallback))
+
+    def formula_array(passed, failed, totalpassed, totalfailed):
+        namespace = dict(EXPRESSION_FUNCTIONS)
+        namespace.update(
+            passed=np.asarray(passed, dtype=np.float64), failed=np.asarray(failed, dtype=np.float64),
+            totalpassed=np.float64(totalpassed), totalfailed=np.float64(totalfailed))
+        shape = namespace['passed'].shape
+        with np.errstate(all='ignore'):
+            value = np.broadcast_to(eval(code, {'__builtins__': {}}, namespace), shape)
+            if np.isfinite(value).all():
+                return value.astype(np.float64)
+            fallback_value = np.broadcast_to(eval(fallback_code, {'__builtins__': {}}, namespace), shape)
+        return np.where(np.isfinite(value), value, fallback_value)
+
+    formula_array.__doc__ = 'Vectorized formula {!r}, {!r} where it divides by zero'.format(expression, fallback)
+    return formula_array
+
+
+def register_formulas(definitions):
+    """
+    Compiles formula expressions and adds them to ``VECTORIZED_FORMULAS``.
+
+    Parameters
+    ----------
+    definitions : dict
+        formula name to an (expression, fallback) pair
+    """
+    for name, (expression, fallback) in definitions.items():
+        if name in FORMULAS or name == 'all':
+            raise ValueError('formula {!r} is already defined'.format(name))
+        VECTORIZED_FORMULAS[name] = compile_formula(expression, fallback)
+
+
+def load_formula_file(formula_file):
+    """
+    Reads formula definitions from a JSON file of the form
+    ``{"kulczynski2": {"expression": "...", "fallback": "0"}}``; the
+    fallback defaults to 0.
+
+    Parameters
+    ----------
+    formula_file : str
+
+    Returns
+    -------
+    dict
+        formula name to an (expression, fallback) pair
+    """
+    with open(formula_file) as freader:
+        formulas = json.load(freader)
+    return {name: (formula['expression'], formula.get('fallback', '0')) for name, formula in formulas.items()}
+
+
 def crush_row(formula, hybrid_scheme, passed, failed, totalpassed, totalfailed, 
               passed_covered=None, failed_covered=None, totalpassed_covered=0, 
               totalfailed_covered=0):
@@ -466,6 +841,42 @@ def crush_row(formula, hybrid_scheme, passed, failed, totalpassed, totalfailed,
     raise ValueError('unrecognized hybrid scheme name: {!r}'.format(hybrid_scheme))
 
 
+def crush_rows(formula, hybrid_scheme, passed, failed, totalpassed, totalfailed,
+               passed_covered=None, failed_covered=None, totalpassed_covered=0,
+               totalfailed_covered=0):
+    """
+    Vectorized ``crush_row``: calculates the suspiciousness of every statement
+    or mutant at once. ``passed``, ``failed``, ``passed_covered`` and
+    ``failed_covered`` are arrays indexed by element number.
+
+    Returns
+    -------
+    numpy.ndarray
+        the suspiciousness value of every element
+    """
+    if hybrid_scheme is None:
+        return VECTORIZED_FORMULAS[formula](passed, failed, totalpassed, totalfailed)
+    elif hybrid_scheme == 'numerator':
+        return VECTORIZED_HYBRID_NUMERATOR_FORMULAS[formula](passed, failed, totalpassed, totalfailed, np.asarray(failed_covered) > 0)
+    elif hybrid_scheme == 'constant':
+        return VECTORIZED_FORMULAS[formula](passed, failed, totalpassed, totalfailed) + (np.asarray(failed_covered) > 0)
+    elif hybrid_scheme == 'mirror':
+        return (VECTORIZED_FORMULAS[formula](passed, failed, totalpassed, totalfailed) +
+                VECTORIZED_FORMULAS[formula](passed_covered, failed_covered, totalpassed_covered, totalfailed_covered))/2.
+    elif hybrid_scheme == 'coverage-only':
+        return VECTORIZED_FORMULAS[formula](passed_covered, failed_covered, totalpassed_covered, totalfailed_covered)
+    raise ValueError('unrecognized hybrid scheme name: {!r}'.format(hybrid_scheme))
+
+
+# Hybrid schemes understood by crush_row and crush_rows
+HYBRID_SCHEMES = ['numerator', 'constant', 'mirror', 'coverage-only']
+
+
+# Formulas that score every element no failing test covers as they score an
+# element no test covers at all, whatever its number of passing tests
+PRUNABLE_FORMULAS = {'tarantula', 'ochiai', 'barinel', 'dstar2', 'jaccard'}
+
+
 # PassFailTally is a container class for number of test cases passed, failed, and total counts
 PassFailTally = collections.namedtuple('PassFailTally', ('n_elements', 'passed', 'failed', 'totalpassed', 'totalfailed'))
 
@@ -509,150 +920,1646 @@ def suspiciousnesses_from_tallies(formula, hybrid_scheme, tally, hybrid_coverage
         }
 
 
+def suspiciousness_array_from_tallies(formula, hybrid_scheme, tally, hybrid_coverage_tally):
+    """
+    Vectorized ``suspiciousnesses_from_tallies``.
+
+    Parameters
+    ----------
+    formula : str
+        the formula to use to calculate suspiciousness
+    hybrid_scheme : str
+        numerator, constant, or mirror
+    tally : PassFailTally
+        an object of the PassFailTally class
+    hybrid_coverage_tally : PassFailTally
+        an object of the PassFailTally class
+
+    Returns
+    -------
+    numpy.ndarray
+        the suspiciousness value indexed by element number
+    """
+    if hybrid_coverage_tally is None:
+        passed_covered = failed_covered = None
+        totalpassed_covered = totalfailed_covered = 0
+    else:
+        passed_covered = hybrid_coverage_tally.passed
+        failed_covered = hybrid_coverage_tally.failed
+        totalpassed_covered = hybrid_coverage_tally.totalpassed
+        totalfailed_covered = hybrid_coverage_tally.totalfailed
+    return crush_rows(
+        formula=formula, hybrid_scheme=hybrid_scheme,
+        passed=tally.passed, failed=tally.failed,
+        totalpassed=tally.totalpassed, totalfailed=tally.totalfailed,
+        passed_covered=passed_covered, failed_covered=failed_covered,
+        totalpassed_covered=totalpassed_covered, totalfailed_covered=totalfailed_covered)
+
+
+# Upper bound on the bytes of coverage unpacked at once from a packed matrix
+PACKED_CHUNK_BYTES = 1 << 24
+
+
+# Approximate bytes held per element by the chunked mode, besides 8 per formula
+CHUNK_ELEMENT_BYTES = 128
+
+# Number of covered cells count_cells passes to np.bincount at once
+BINCOUNT_CHUNK = 1 << 20
+
+
 # TestSummary is a container class for test summary information
 TestSummary = collections.namedtuple('TestSummary', ('triggering', 'covered_elements'))
 
 
 def parse_test_summary(line, n_elements):
-    words = line.strip().split(' ')
-    coverages, sign = words[:-1], words[-1]
-    if len(coverages) != n_elements:
-        raise ValueError("expected {expected} elements in each row, got {actual} in {line!r}".format(expected=n_elements, actual=len(coverages), line=line))
+    coverage, triggering = gzoltar.parse_matrix_row(line, n_elements)
     return TestSummary(
-        triggering=(sign == '-'),
-        covered_elements=set(i for i in range(len(words)) if words[i]=='1'))
+        triggering=triggering,
+        covered_elements=set(np.flatnonzero(coverage).tolist()))
 
 
-def tally_matrix(matrix_file, total_defn, n_elements):
+# SparseCoverage is a container class for a coverage matrix in compressed sparse row form:
+# the elements covered by row i are indices[indptr[i]:indptr[i+1]], and weights[i] is the
+# number of tests that share row i's coverage and outcome
+SparseCoverage = collections.namedtuple('SparseCoverage', ('n_elements', 'indptr', 'indices', 'triggering', 'weights'))
+
+
+def read_sparse_matrix(matrix_file, n_elements):
     """
-    Returns a PassFailTally describing how many passing/failing tests there are, 
-    and how many of each cover each code element.
+    Reads a coverage matrix row by row into a SparseCoverage, so memory
+    scales with the number of covered cells rather than tests x elements.
+
+    Each row is hashed together with its sign, and tests whose row has
+    already been seen only increment that row's weight instead of being
+    parsed and stored again.
 
     Parameters
     ----------
+    matrix_file : file
+        the coverage matrix, one test per line, preferably opened in
+        binary mode
+    n_elements : int
+        the number of code elements each row should indicate coverage for
 
-    total_defn : str 
-        may be "tests" (in which case the tally's ``totalpassed`` will be the 
-        number of passing tests) or "elements" (in which case it'll be the 
-        number of times a passing test covers a code element) 
-        (and same for ``totalfailed``).
-    n_elements : str 
-        is the number of code elements that each row of the matrix 
-        should indicate coverage for.
-    
     Returns
     -------
-    namedtuple
+    SparseCoverage
+    """
+    rows = []
+    triggering = []
+    weights = []
+    seen = {}
+    for line in matrix_file:
+        row = line.strip()
+        key = hashlib.blake2b(row if isinstance(row, bytes) else row.encode('ascii'), digest_size=16).digest()
+        if key in seen:
+            weights[seen[key]] += 1
+            continue
+        coverage, failed = gzoltar.parse_matrix_row(line, n_elements)
+        seen[key] = len(rows)
+        rows.append(np.flatnonzero(coverage).astype(np.int32))
+        triggering.append(failed)
+        weights.append(1)
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=indptr[1:])
+    indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+    return SparseCoverage(n_elements, indptr, indices, np.array(triggering, dtype=bool), np.array(weights, dtype=np.int64))
+
+
+def tally_sparse(coverage, total_defn):
+    """
+    Returns a PassFailTally for a SparseCoverage.
 
+    Parameters
+    ----------
+    coverage : SparseCoverage
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+
+    Returns
+    -------
+    PassFailTally
+    """
+    n_elements = coverage.n_elements
+    # Every distinct row counts once over all the cells, the failing rows
+    # (usually few) are counted apart and the passing ones are the rest
+    failed = count_cells(sparse_row_cells(coverage, np.flatnonzero(coverage.triggering)), n_elements)
+    passed = count_cells(coverage.indices, n_elements) - failed
+
+    # Rows standing for several identical tests count again for their
+    # other copies, over just the cells of those rows
+    for counts, rows in [(passed, np.flatnonzero((coverage.weights > 1) & ~coverage.triggering)),
+                         (failed, np.flatnonzero((coverage.weights > 1) & coverage.triggering))]:
+        if len(rows):
+            cell_weights = np.repeat(coverage.weights[rows] - 1, np.diff(coverage.indptr)[rows])
+            counts += np.rint(np.bincount(
+                sparse_row_cells(coverage, rows), weights=cell_weights, minlength=n_elements)).astype(np.int64)
+    totalpassed, totalfailed = sparse_totals(coverage, total_defn)
+
+    return PassFailTally(coverage.n_elements, passed, failed, totalpassed, totalfailed)
+
+
+def count_cells(cells, n_elements):
     """
-    summaries = (parse_test_summary(line, n_elements) for line in matrix_file)
+    Counts how often each element occurs in an array of covered elements.
 
-    passed = {i: 0 for i in range(n_elements)}
-    failed = {i: 0 for i in range(n_elements)}
-    totalpassed = 0
-    totalfailed = 0
-    for summary in summaries:
-        if summary.triggering:
-            totalfailed += (1 if total_defn == 'tests' else len(summary.covered_elements))
-            for element_number in summary.covered_elements:
-                failed[element_number] += 1
-        else:
-            totalpassed += (1 if total_defn == 'tests' else len(summary.covered_elements))
-            for element_number in summary.covered_elements:
-                passed[element_number] += 1
+    ``np.bincount`` copies its input to the platform integer type first, so
+    the cells are counted ``BINCOUNT_CHUNK`` at a time to bound that copy.
 
-    return PassFailTally(n_elements, passed, failed, totalpassed, totalfailed)
+    Parameters
+    ----------
+    cells : numpy.ndarray
+        covered element numbers
+    n_elements : int
 
+    Returns
+    -------
+    numpy.ndarray
+        the int64 count of every element
+    """
+    counts = np.zeros(n_elements, dtype=np.int64)
+    for start in range(0, len(cells), BINCOUNT_CHUNK):
+        counts += np.bincount(cells[start:start+BINCOUNT_CHUNK], minlength=n_elements)
+    return counts
 
-def parse_bug_from_file_name(coverage_file):
+
+def sparse_row_cells(coverage, rows):
     """
-    Parse bug from file name by looking
+    Returns the covered elements of some rows of a SparseCoverage, without
+    touching the cells of the other rows.
 
     Parameters
     ----------
-    coverage_file : str
-        the path to the coverage file
-    
+    coverage : SparseCoverage
+    rows : numpy.ndarray
+        the row numbers
+
     Returns
     -------
-    str
-        returns the project and bug eg Closure-11
+    numpy.ndarray
+        the covered elements of each row in turn
     """
-    return '-'.join(coverage_file.split('/')[-1].split('-')[:-1])
+    starts = coverage.indptr[rows]
+    lengths = coverage.indptr[rows + 1] - starts
+    offsets = np.cumsum(lengths) - lengths
+    return coverage.indices[np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)]
 
 
-def generate_suspiciousness(formula, coverage_file, spectra_file, output_dir):
+def sparse_totals(coverage, total_defn):
     """
-    Generates the suspiciousness value for each bug in the dataset.
-
-    The method reads the coverage file and the spectra file, and uses 
-    the method given in the fault-localization-data to generate a value
-    between 0 and 1.
+    Returns the ``totalpassed`` and ``totalfailed`` of a SparseCoverage.
 
     Parameters
     ----------
-    formula : str
-        which formula to use for computing suspiciousness
-    coverage_file : str
-        path to the coverage file
-    spectra_file : str
-        path to the spectra file
-    output_dir : str
+    coverage : SparseCoverage
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
 
-    
     Returns
     -------
-    dict
-        suspiciousness value for all lines
+    tuple(int, int)
     """
-    with open(spectra_file) as name_file:
-        element_names = {i: name.strip() for i, name in enumerate(name_file)}
+    if total_defn == 'tests':
+        per_row = coverage.weights
+    else:
+        per_row = coverage.weights * np.diff(coverage.indptr)
+    return int(per_row[~coverage.triggering].sum()), int(per_row[coverage.triggering].sum())
 
-    n_elements = len(element_names)
 
-    with open(coverage_file) as matrix_file:
-        tally = tally_matrix(matrix_file, 'tests', n_elements=n_elements)
+def group_identical_columns(coverage):
+    """
+    Groups the elements whose coverage columns are identical, as statements
+    of the same basic block are.
 
-    suspiciousnesses = suspiciousnesses_from_tallies(
-        formula=formula, hybrid_scheme=None,
-        tally=tally, hybrid_coverage_tally=None)
+    Each column is hashed by summing two independent random 64-bit keys of
+    the tests covering it, so grouping costs one pass over the covered
+    cells. With 128 bits of hash, distinct columns colliding is not a
+    practical concern.
 
-    bug = parse_bug_from_file_name(coverage_file)
+    Parameters
+    ----------
+    coverage : SparseCoverage
 
-    with open(os.path.join(output_dir, '%s-%s-suspiciousness' % (bug, formula)), 'w') as output_file:
-        writer = csv.DictWriter(output_file, ['Statement','Suspiciousness'])
-        writer.writeheader()
-        for element in range(n_elements):
-            writer.writerow({
-                'Statement': element_names[element],
-                'Suspiciousness': suspiciousnesses[element]})
-    
-    return suspiciousnesses
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        the first element of every group, and the group of every element
+    """
+    n_tests = len(coverage.triggering)
+    keys = np.random.RandomState(0).randint(np.iinfo(np.uint64).max, size=(2, n_tests), dtype=np.uint64)
+    entry_tests = np.repeat(np.arange(n_tests), np.diff(coverage.indptr))
+    hashes = np.zeros((coverage.n_elements, 2), dtype=np.uint64)
+    for column in range(2):
+        np.add.at(hashes[:, column], coverage.indices, keys[column][entry_tests])
+    _, representatives, groups = np.unique(hashes, axis=0, return_index=True, return_inverse=True)
+    # Number the groups in spectra order of their first element
+    order = np.argsort(representatives, kind='stable')
+    renumber = np.empty_like(order)
+    renumber[order] = np.arange(len(order))
+    return representatives[order], renumber[groups.reshape(-1)]
+
+
+def collapse_columns(coverage):
+    """
+    Collapses identical coverage columns into one column per group.
 
+    Parameters
+    ----------
+    coverage : SparseCoverage
+
+    Returns
+    -------
+    tuple(SparseCoverage, numpy.ndarray)
+        the coverage over groups and the group of every element, see
+        ``group_identical_columns``
+    """
+    representatives, groups = group_identical_columns(coverage)
+    is_representative = np.zeros(coverage.n_elements, dtype=bool)
+    is_representative[representatives] = True
+    keep = is_representative[coverage.indices]
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    collapsed = SparseCoverage(
+        len(representatives), kept_before[coverage.indptr],
+        groups[coverage.indices[keep]].astype(np.int32), coverage.triggering, coverage.weights)
+    return collapsed, groups
+
+
+def tally_matrix(matrix_file, total_defn, n_elements):
+    """
+    Returns a PassFailTally describing how many passing/failing tests there are, 
+    and how many of each cover each code element.
+
+    Parameters
+    ----------
+
+    total_defn : str 
+        may be "tests" (in which case the tally's ``totalpassed`` will be the 
+        number of passing tests) or "elements" (in which case it'll be the 
+        number of times a passing test covers a code element) 
+        (and same for ``totalfailed``).
+    n_elements : str 
+        is the number of code elements that each row of the matrix 
+        should indicate coverage for.
+    
+    Returns
+    -------
+    namedtuple
+
+    """
+    # Rows are counted as they are read. Each row is keyed by a digest, and
+    # only rows which recur keep their covered elements, so that further
+    # copies are not parsed again.
+    passed = np.zeros(n_elements, dtype=np.int64)
+    failed = np.zeros(n_elements, dtype=np.int64)
+    totalpassed = 0
+    totalfailed = 0
+    seen = set()
+    repeated = {}
+    for line in matrix_file:
+        row = line.strip()
+        key = hashlib.blake2b(row if isinstance(row, bytes) else row.encode('ascii'), digest_size=16).digest()
+        if key in repeated:
+            covered, triggering = repeated[key]
+        else:
+            coverage, triggering = gzoltar.parse_matrix_row(row, n_elements)
+            covered = np.flatnonzero(coverage).astype(np.int32)
+            if key in seen:
+                repeated[key] = covered, triggering
+            else:
+                seen.add(key)
+        if triggering:
+            failed[covered] += 1
+            totalfailed += (1 if total_defn == 'tests' else len(covered))
+        else:
+            passed[covered] += 1
+            totalpassed += (1 if total_defn == 'tests' else len(covered))
+
+    passed = dict(enumerate(passed.tolist()))
+    failed = dict(enumerate(failed.tolist()))
+    return PassFailTally(n_elements, passed, failed, totalpassed, totalfailed)
+
+
+def tally_matrix_array(matrix_file, total_defn, n_elements):
+    """
+    Array-backed version of ``tally_matrix``.
+
+    The matrix is read into a SparseCoverage and the per-element counts are
+    counted over the covered cells of the passing and failing rows.
+    ``passed`` and ``failed`` in the returned tally are int64 arrays indexed
+    by element number.
+
+    Parameters
+    ----------
+    matrix_file : file
+        the coverage matrix, one test per line
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+    n_elements : int
+        is the number of code elements that each row of the matrix
+        should indicate coverage for.
+
+    Returns
+    -------
+    PassFailTally
+    """
+    return tally_sparse(read_sparse_matrix(matrix_file, n_elements), total_defn)
+
+
+def tally_matrix_grouped(matrix_file, total_defn, n_elements):
+    """
+    Like ``tally_matrix_array``, but elements with identical coverage
+    columns are collapsed first and tallied once per group.
+
+    Parameters
+    ----------
+    matrix_file : file
+        the coverage matrix, one test per line
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+    n_elements : int
+        is the number of code elements that each row of the matrix
+        should indicate coverage for.
+
+    Returns
+    -------
+    tuple(PassFailTally, numpy.ndarray)
+        the tally indexed by group number, and the group of every element
+    """
+    return tally_sparse_grouped(read_sparse_matrix(matrix_file, n_elements), total_defn)
+
+
+def tally_sparse_grouped(coverage, total_defn):
+    """
+    Tallies a SparseCoverage once per group of identical coverage columns.
+
+    Parameters
+    ----------
+    coverage : SparseCoverage
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+
+    Returns
+    -------
+    tuple(PassFailTally, numpy.ndarray)
+        the tally indexed by group number, and the group of every element
+    """
+    collapsed, groups = collapse_columns(coverage)
+    totalpassed, totalfailed = sparse_totals(coverage, total_defn)
+    tally = tally_sparse(collapsed, total_defn)._replace(totalpassed=totalpassed, totalfailed=totalfailed)
+    return tally, groups
+
+
+def prune_tally(tally):
+    """
+    Restricts a full tally to the elements covered by a failing test, the
+    way ``tally_matrix_pruned`` does, for matrices whose full tally is
+    cheap to get.
+
+    Parameters
+    ----------
+    tally : PassFailTally
+        the tally indexed by element number, with array counts
+
+    Returns
+    -------
+    tuple(PassFailTally, numpy.ndarray)
+        see ``tally_matrix_pruned``
+    """
+    if tally.totalfailed == 0:
+        return tally, None
+    candidates = np.flatnonzero(tally.failed)
+    groups = np.full(tally.n_elements, len(candidates), dtype=np.int64)
+    groups[candidates] = np.arange(len(candidates))
+    pruned = PassFailTally(
+        len(candidates) + 1, np.append(tally.passed[candidates], 0), np.append(tally.failed[candidates], 0),
+        tally.totalpassed, tally.totalfailed)
+    return pruned, groups
+
+
+def tally_matrix_pruned(matrix_file, total_defn, n_elements):
+    """
+    Tallies only the elements covered by at least one failing test.
+
+    A first pass over the matrix parses just the failing rows to find the
+    candidate elements; a second pass reads the passing rows only at the
+    candidate cells. Every other element has ``failed == 0`` and so gets the
+    same score from the formulas in ``PRUNABLE_FORMULAS`` as an element
+    covered by no test at all. They all share one extra group whose tally
+    is zero, so the scoring cost follows the failing tests' footprint
+    rather than the whole program.
+
+    Parameters
+    ----------
+    matrix_file : file
+        the coverage matrix, one test per line, opened in binary mode and
+        seekable, as it is read twice
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+    n_elements : int
+        is the number of code elements that each row of the matrix
+        should indicate coverage for.
+
+    Returns
+    -------
+    tuple(PassFailTally, numpy.ndarray)
+        the tally indexed by group number and the group of every element,
+        or a tally indexed by element and None if no test failed
+    """
+    failed = np.zeros(n_elements, dtype=np.int64)
+    totalfailed = 0
+    for line in matrix_file:
+        row = line.strip()
+        if row[-1:] != b'-':
+            continue
+        coverage, _ = gzoltar.parse_matrix_row(line, n_elements)
+        failed += coverage
+        totalfailed += (1 if total_defn == 'tests' else int(coverage.sum()))
+    candidates = np.flatnonzero(failed)
+
+    matrix_file.seek(0)
+    if totalfailed == 0:
+        # Without failing tests dstar2 tells apart uncovered elements by
+        # their passing tests, so tally everything
+        return tally_matrix_array(matrix_file, total_defn, n_elements), None
+
+    passed = np.zeros(len(candidates), dtype=np.int64)
+    totalpassed = 0
+    cells = 2 * candidates
+    for line in matrix_file:
+        row = line.strip()
+        if row[-1:] == b'-':
+            continue
+        if len(row) == 2 * n_elements + 1:
+            passed += np.frombuffer(row, dtype=np.uint8)[cells] == gzoltar.ONE
+            totalpassed += (1 if total_defn == 'tests' else row.count(b'1'))
+        else:
+            coverage, _ = gzoltar.parse_matrix_row(line, n_elements)
+            passed += coverage[candidates]
+            totalpassed += (1 if total_defn == 'tests' else int(coverage.sum()))
+
+    groups = np.full(n_elements, len(candidates), dtype=np.int64)
+    groups[candidates] = np.arange(len(candidates))
+    tally = PassFailTally(
+        len(candidates) + 1, np.append(passed, 0), np.append(failed[candidates], 0),
+        totalpassed, totalfailed)
+    return tally, groups
+
+
+def tally_matrix_columns(coverage_file, total_defn, n_elements, start, stop):
+    """
+    Returns a PassFailTally for the elements ``start`` to ``stop`` of a text
+    coverage matrix, streaming the matrix and reading only that block of
+    cells from each fixed-width row. The totals cover the whole matrix.
+
+    Parameters
+    ----------
+    coverage_file : str
+        path to the text coverage matrix
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+    n_elements : int
+        the number of code elements each row should indicate coverage for
+    start : int
+        the first element of the block
+    stop : int
+        one past the last element of the block
+
+    Returns
+    -------
+    PassFailTally
+        the tally indexed by element number minus ``start``
+    """
+    passed = np.zeros(stop - start, dtype=np.int64)
+    failed = np.zeros(stop - start, dtype=np.int64)
+    totalpassed = 0
+    totalfailed = 0
+    with open(coverage_file, 'rb') as matrix_file:
+        for line in matrix_file:
+            row = line.strip()
+            if len(row) == 2 * n_elements + 1:
+                cells = np.frombuffer(row, dtype=np.uint8)[2*start:2*stop:2] == gzoltar.ONE
+                triggering = row[-1:] == b'-'
+                n_covered = row.count(b'1') if total_defn == 'elements' else 0
+            else:
+                coverage, triggering = gzoltar.parse_matrix_row(line, n_elements)
+                cells = coverage[start:stop]
+                n_covered = int(coverage.sum())
+            if triggering:
+                failed += cells
+                totalfailed += (1 if total_defn == 'tests' else n_covered)
+            else:
+                passed += cells
+                totalpassed += (1 if total_defn == 'tests' else n_covered)
+
+    return PassFailTally(stop - start, passed, failed, totalpassed, totalfailed)
+
+
+class IncrementalTally(object):
+    """
+    A PassFailTally that is updated one test at a time, so suspiciousness
+    can be computed while the test suite is still running.
+
+    Adding or retracting a test costs time proportional to the number of
+    elements it covers.
+    """
+    def __init__(self, n_elements, total_defn='tests'):
+        self.n_elements = n_elements
+        self.total_defn = total_defn
+        self.passed = np.zeros(n_elements, dtype=np.int64)
+        self.failed = np.zeros(n_elements, dtype=np.int64)
+        self.totalpassed = 0
+        self.totalfailed = 0
+
+    def add_row(self, covered_elements, triggering, count=1):
+        """
+        Add a test to the tally
+
+        Parameters
+        ----------
+        covered_elements : sequence
+            the distinct element numbers the test covers
+        triggering : bool
+            whether the test failed
+        count : int
+            how many times to add the test, negative to retract it
+        """
+        covered_elements = np.asarray(covered_elements, dtype=np.int64)
+        total = count * (1 if self.total_defn == 'tests' else len(covered_elements))
+        if triggering:
+            self.failed[covered_elements] += count
+            self.totalfailed += total
+        else:
+            self.passed[covered_elements] += count
+            self.totalpassed += total
+
+    def remove_row(self, covered_elements, triggering):
+        """
+        Retract a test previously added with ``add_row``
+
+        Parameters
+        ----------
+        covered_elements : sequence
+            the distinct element numbers the test covers
+        triggering : bool
+            whether the test failed
+        """
+        self.add_row(covered_elements, triggering, count=-1)
+
+    def add_line(self, line):
+        """
+        Add a test given as a row of the GZoltar matrix
+
+        Parameters
+        ----------
+        line : bytes or str
+            a row of the GZoltar matrix, e.g. "0 1 0 +"
+        """
+        coverage, triggering = gzoltar.parse_matrix_row(line, self.n_elements)
+        self.add_row(np.flatnonzero(coverage), triggering)
+
+    def remove_line(self, line):
+        """
+        Retract a test previously added with ``add_line``
+
+        Parameters
+        ----------
+        line : bytes or str
+            a row of the GZoltar matrix, e.g. "0 1 0 +"
+        """
+        coverage, triggering = gzoltar.parse_matrix_row(line, self.n_elements)
+        self.remove_row(np.flatnonzero(coverage), triggering)
+
+    @property
+    def tally(self):
+        """
+        The current PassFailTally. Its ``passed`` and ``failed`` arrays are
+        shared with this object and change as tests are added.
+        """
+        return PassFailTally(self.n_elements, self.passed, self.failed, self.totalpassed, self.totalfailed)
+
+    def suspiciousness(self, formula, hybrid_scheme=None, hybrid_coverage_tally=None):
+        """
+        Compute the current suspiciousness of every element
+
+        Parameters
+        ----------
+        formula : str
+            the formula to use to calculate suspiciousness
+        hybrid_scheme : str
+            see ``suspiciousness_array_from_tallies``
+        hybrid_coverage_tally : PassFailTally
+            see ``suspiciousness_array_from_tallies``
+
+        Returns
+        -------
+        numpy.ndarray
+            the suspiciousness value indexed by element number
+        """
+        return suspiciousness_array_from_tallies(formula, hybrid_scheme, self.tally, hybrid_coverage_tally)
+
+    def top_k(self, formula, k):
+        """
+        Compute the current k most suspicious elements
+
+        Parameters
+        ----------
+        formula : str
+            the formula to use to calculate suspiciousness
+        k : int
+            the number of elements to return
+
+        Returns
+        -------
+        list
+            (element number, suspiciousness) pairs, most suspicious first
+            and ties broken by element number
+        """
+        suspiciousnesses = self.suspiciousness(formula)
+        order = top_elements(suspiciousnesses, k)
+        return list(zip(order.tolist(), suspiciousnesses[order].tolist()))
+
+
+def tally_packed_coverage(packed, total_defn):
+    """
+    Returns a PassFailTally for a packed coverage matrix.
+
+    The memory mapped rows are unpacked a block of tests at a time, so
+    memory use is bounded by ``PACKED_CHUNK_BYTES`` whatever the matrix size.
+
+    Parameters
+    ----------
+    packed : gzoltar.PackedCoverage
+        the memory mapped packed coverage matrix
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+
+    Returns
+    -------
+    PassFailTally
+    """
+    n_elements = packed.n_elements
+    triggering = np.asarray(packed.triggering)
+    passed = np.zeros(n_elements, dtype=np.int64)
+    failed = np.zeros(n_elements, dtype=np.int64)
+    chunk = max(1, PACKED_CHUNK_BYTES // max(1, n_elements))
+    for start in range(0, packed.n_tests, chunk):
+        coverage = np.unpackbits(packed.rows[start:start+chunk], axis=1, count=n_elements)
+        chunk_triggering = triggering[start:start+chunk]
+        passed += coverage[~chunk_triggering].sum(axis=0, dtype=np.int64)
+        failed += coverage[chunk_triggering].sum(axis=0, dtype=np.int64)
+
+    if total_defn == 'tests':
+        totalpassed = int(np.count_nonzero(~triggering))
+        totalfailed = int(np.count_nonzero(triggering))
+    else:
+        totalpassed = int(passed.sum())
+        totalfailed = int(failed.sum())
+
+    return PassFailTally(n_elements, passed, failed, totalpassed, totalfailed)
+
+
+def read_packed_sparse(packed):
+    """
+    Reads a packed coverage matrix into a SparseCoverage, unpacking a block
+    of tests at a time as ``tally_packed_coverage`` does.
+
+    Parameters
+    ----------
+    packed : gzoltar.PackedCoverage
+        the memory mapped packed coverage matrix
+
+    Returns
+    -------
+    SparseCoverage
+        with a weight of one for every test
+    """
+    n_elements = packed.n_elements
+    row_lengths = [np.zeros(0, dtype=np.int64)]
+    indices = [np.zeros(0, dtype=np.int32)]
+    chunk = max(1, PACKED_CHUNK_BYTES // max(1, n_elements))
+    for start in range(0, packed.n_tests, chunk):
+        coverage = np.unpackbits(packed.rows[start:start+chunk], axis=1, count=n_elements)
+        row_lengths.append(coverage.sum(axis=1, dtype=np.int64))
+        indices.append(np.nonzero(coverage)[1].astype(np.int32))
+    indptr = np.zeros(packed.n_tests + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(row_lengths), out=indptr[1:])
+    return SparseCoverage(
+        n_elements, indptr, np.concatenate(indices), np.asarray(packed.triggering, dtype=bool),
+        np.ones(packed.n_tests, dtype=np.int64))
+
+
+def load_packed_coverage(coverage_file, n_elements):
+    """
+    Memory maps a packed coverage file, checking its number of elements.
+
+    Parameters
+    ----------
+    coverage_file : str
+        path to the packed coverage file
+    n_elements : int
+        the number of code elements in the spectra
+
+    Returns
+    -------
+    gzoltar.PackedCoverage
+    """
+    packed = gzoltar.load_packed_coverage(coverage_file)
+    if packed.n_elements != n_elements:
+        raise ValueError("expected {expected} elements in each row, got {actual} in {file!r}".format(expected=n_elements, actual=packed.n_elements, file=coverage_file))
+    return packed
+
+
+def tally_coverage_file(coverage_file, total_defn, n_elements):
+    """
+    Returns a PassFailTally for a coverage file, which may be either a text
+    GZoltar matrix or a packed coverage file written by matrix_coverage.py.
+
+    Parameters
+    ----------
+    coverage_file : str
+        path to the coverage file
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+    n_elements : int
+        the number of code elements in the spectra
+
+    Returns
+    -------
+    PassFailTally
+    """
+    if gzoltar.is_packed_coverage(coverage_file):
+        return tally_packed_coverage(load_packed_coverage(coverage_file, n_elements), total_defn)
+    with open(coverage_file, 'rb') as matrix_file:
+        return tally_matrix_array(matrix_file, total_defn, n_elements=n_elements)
+
+
+def load_tally(coverage_file, spectra_file, total_defn, tally_cache=None, collapse=False, prune=False):
+    """
+    Reads the spectra and tallies the coverage matrix of a bug.
+
+    ``coverage_file`` and ``spectra_file`` are either the extracted coverage
+    and spectra files, or both the path of the bug's original
+    gzoltar-files.tar.gz, in which case the spectra and matrix are streamed
+    straight out of the archive.
+
+    With a ``tally_cache`` directory the tally is looked up by the content
+    hash of the inputs, and stored there after it is computed.
+
+    Parameters
+    ----------
+    coverage_file : str
+        path to the coverage file or tarball
+    spectra_file : str
+        path to the spectra file or tarball
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+    tally_cache : str
+        directory of cached tallies, or None to always tally the matrix
+    collapse : bool
+        tally once per group of identical coverage columns, see
+        ``tally_matrix_grouped``
+    prune : bool
+        tally only the elements covered by a failing test, see
+        ``tally_matrix_pruned`` and ``prune_tally``; the tally is then only
+        valid for ``PRUNABLE_FORMULAS``. Takes precedence over ``collapse``.
+
+    Returns
+    -------
+    tuple(list, PassFailTally, numpy.ndarray)
+        the spectra entry of each element, the tally and the group of every
+        element the tally is indexed by, or None if it is indexed by element
+    """
+    if tally_cache is not None:
+        variant = '-pruned' if prune else ('-collapsed' if collapse else '')
+        cache_key = tally_cache_key(coverage_file, spectra_file, total_defn + variant)
+        cache_file = os.path.join(tally_cache, '%s.npz' % cache_key)
+        if os.path.exists(cache_file):
+            return load_cached_tally(cache_file)
+        element_names, tally, groups = load_tally(coverage_file, spectra_file, total_defn, collapse=collapse, prune=prune)
+        save_cached_tally(cache_file, element_names, tally, groups)
+        return element_names, tally, groups
+
+    def tally_text(matrix_file, n_elements):
+        if prune:
+            return tally_matrix_pruned(matrix_file, total_defn, n_elements)
+        if collapse:
+            return tally_matrix_grouped(matrix_file, total_defn, n_elements)
+        return tally_matrix_array(matrix_file, total_defn, n_elements), None
+
+    if gzoltar.is_gzoltar_tarball(coverage_file):
+        tar, matrix, spectra = gzoltar.open_gzoltar_tarball(coverage_file)
+        with tar:
+            element_names = [name.strip() for name in io.TextIOWrapper(tar.extractfile(spectra))]
+            with tar.extractfile(matrix) as matrix_file:
+                tally, groups = tally_text(matrix_file, len(element_names))
+        return element_names, tally, groups
+
+    with open(spectra_file) as name_file:
+        element_names = [name.strip() for name in name_file]
+    if gzoltar.is_packed_coverage(coverage_file):
+        packed = load_packed_coverage(coverage_file, len(element_names))
+        if prune:
+            # The full tally of a packed matrix is cheap, prune it afterwards
+            tally, groups = prune_tally(tally_packed_coverage(packed, total_defn))
+        elif collapse:
+            tally, groups = tally_sparse_grouped(read_packed_sparse(packed), total_defn)
+        else:
+            tally, groups = tally_packed_coverage(packed, total_defn), None
+        return element_names, tally, groups
+    with open(coverage_file, 'rb') as matrix_file:
+        tally, groups = tally_text(matrix_file, len(element_names))
+    return element_names, tally, groups
+
+
+def tally_cache_key(coverage_file, spectra_file, total_defn):
+    """
+    Returns the key a bug's tally is cached under: a hash of the contents
+    of its coverage and spectra files and of ``total_defn``.
+
+    Parameters
+    ----------
+    coverage_file : str
+        path to the coverage file or tarball
+    spectra_file : str
+        path to the spectra file or tarball
+    total_defn : str
+        "tests" or "elements", see ``tally_matrix``
+
+    Returns
+    -------
+    str
+    """
+    sha1 = hashlib.sha1(total_defn.encode('ascii'))
+    for input_file in sorted(set([coverage_file, spectra_file])):
+        sha1.update(matrix_coverage.hash_file(input_file).encode('ascii'))
+    return sha1.hexdigest()
+
+
+def save_cached_tally(cache_file, element_names, tally, groups=None):
+    """
+    Stores a tally and its element names as a compressed numpy archive.
+
+    Parameters
+    ----------
+    cache_file : str
+        path of the archive to write
+    element_names : list
+        the spectra entry of each element
+    tally : PassFailTally
+    groups : numpy.ndarray
+        the group of every element if the tally is indexed by group
+    """
+    gzoltar.ensure_dir(os.path.dirname(cache_file))
+    arrays = dict(
+        element_names=np.array(element_names, dtype=str),
+        passed=np.asarray(tally.passed, dtype=np.int64),
+        failed=np.asarray(tally.failed, dtype=np.int64),
+        totals=np.array([tally.totalpassed, tally.totalfailed], dtype=np.int64))
+    if groups is not None:
+        arrays['groups'] = groups
+    with gzoltar.atomic_open(cache_file) as cache:
+        np.savez_compressed(cache, **arrays)
+
+
+def load_cached_tally(cache_file):
+    """
+    Loads a tally stored by ``save_cached_tally``.
+
+    Parameters
+    ----------
+    cache_file : str
+        path of the archive to read
+
+    Returns
+    -------
+    tuple(list, PassFailTally, numpy.ndarray)
+        the spectra entry of each element, the tally and the group of every
+        element, see ``load_tally``
+    """
+    with np.load(cache_file) as cache:
+        element_names = cache['element_names'].tolist()
+        totalpassed, totalfailed = cache['totals'].tolist()
+        tally = PassFailTally(len(cache['passed']), cache['passed'], cache['failed'], totalpassed, totalfailed)
+        groups = cache['groups'] if 'groups' in cache else None
+    return element_names, tally, groups
+
+
+def parse_bug_from_file_name(coverage_file):
+    """
+    Parse bug from file name by looking
+
+    Parameters
+    ----------
+    coverage_file : str
+        the path to the coverage file
+    
+    Returns
+    -------
+    str
+        returns the project and bug eg Closure-11
+    """
+    if gzoltar.is_gzoltar_tarball(coverage_file):
+        # <data-dir>/<project>/<bug>/gzoltar-files.tar.gz
+        return '-'.join(coverage_file.split('/')[-3:-1])
+    return '-'.join(coverage_file.split('/')[-1].split('-')[:-1])
+
+
+def top_elements(suspiciousnesses, k, elements=None):
+    """
+    Select the k most suspicious elements without sorting every score.
+
+    The k-th highest score is found with a linear-time partition and only
+    the elements scoring at least that much are sorted. Ties are broken by
+    element number and NaN scores rank last, so the selection does not
+    depend on the partition.
+
+    Parameters
+    ----------
+    suspiciousnesses : numpy.ndarray
+        the suspiciousness values
+    k : int
+        the number of elements to select
+    elements : numpy.ndarray
+        the element number of each suspiciousness value, if they are not
+        indexed by element number
+
+    Returns
+    -------
+    numpy.ndarray
+        positions into ``suspiciousnesses``, most suspicious first
+    """
+    ranked = np.where(np.isnan(suspiciousnesses), -np.inf, suspiciousnesses)
+    n = len(ranked)
+    if k < n:
+        threshold = np.partition(ranked, n - k)[n - k]
+        candidates = np.flatnonzero(ranked >= threshold)
+    else:
+        candidates = np.arange(n)
+    tie_breaks = candidates if elements is None else elements[candidates]
+    return candidates[np.lexsort((tie_breaks, -ranked[candidates]))][:k]
+
+
+def load_source_code(bug, source_code_lines):
+    """
+    Reads the sub-line index of a bug for ``element_lines``.
+
+    Parameters
+    ----------
+    bug : str
+        the project and bug eg Closure-11
+    source_code_lines : str
+        directory of the ``<project>-<bug>b.source-code.lines`` files
+
+    Returns
+    -------
+    dict
+        line to the list of additional lines that belong to it
+    """
+    return s2l_suspiciousness.read_source_code_lines(os.path.join(
+        source_code_lines, '%sb%s' % (bug, s2l_suspiciousness.SOURCE_CODE_SUFFIX)))
+
+
+def element_lines(element_names, source_code, statements=None):
+    """
+    Maps elements to the source lines they stand for.
+
+    This is the conversion ``s2l_suspiciousness.convert_statement_to_line``
+    does, computed once per bug so that line suspiciousness files can be
+    written without a statement suspiciousness file in between.
+
+    Parameters
+    ----------
+    element_names : list
+        the spectra entry of each element
+    source_code : dict
+        the sub-line index of the bug, see ``load_source_code``
+    statements : s2l_suspiciousness.StatementDictionary
+        the statement dictionary of the bug, if it already interned the
+        elements
+
+    Returns
+    -------
+    list
+        the ``file.java#line`` followed by its sub-lines, for every element
+    """
+    if statements is None:
+        statements = s2l_suspiciousness.StatementDictionary()
+    lines = []
+    for name in element_names:
+        line = statements.lines[statements.add(name)]
+        lines.append([line] + source_code.get(line, []))
+    return lines
+
+
+def open_suspiciousness_file(output_dir, bug, formula, line_level=False):
+    """
+    Opens the suspiciousness csv file of a bug and writes its header.
+
+    Parameters
+    ----------
+    output_dir : str
+        the directory to write the suspiciousness file to
+    bug : str
+        the project and bug eg Closure-11
+    formula : str
+        the formula the suspiciousness values were computed with
+    line_level : bool
+        open the ``<bug>-<formula>-line-suspiciousness`` file written by
+        ``s2l_suspiciousness.py`` instead of the statement one
+
+    Returns
+    -------
+    tuple(file, function)
+        the open file and a function writing a (name, suspiciousness) row
+    """
+    if line_level:
+        output_file = open(os.path.join(output_dir, '%s-%s-line-suspiciousness' % (bug, formula)), 'w')
+        column = 'Line'
+    else:
+        output_file = open(os.path.join(output_dir, '%s-%s-suspiciousness' % (bug, formula)), 'w')
+        column = 'Statement'
+    writer = csv.DictWriter(output_file, [column, 'Suspiciousness'])
+    writer.writeheader()
+    return output_file, lambda name, suspiciousness: writer.writerow({column: name, 'Suspiciousness': suspiciousness})
+
+
+def write_suspiciousness(output_dir, bug, formula, element_names, suspiciousnesses, top_k=None, lines=None):
+    """
+    Writes the ``<bug>-<formula>-suspiciousness`` csv file for a bug.
+
+    Parameters
+    ----------
+    output_dir : str
+        the directory to write the suspiciousness file to
+    bug : str
+        the project and bug eg Closure-11
+    formula : str
+        the formula the suspiciousness values were computed with
+    element_names : list
+        the spectra entry of each element
+    suspiciousnesses : numpy.ndarray
+        the suspiciousness value indexed by element number
+    top_k : int
+        if given, write only the top_k most suspicious elements, most
+        suspicious first, see ``top_elements``
+    lines : list
+        if given, the lines of each element from ``element_lines``, and the
+        ``<bug>-<formula>-line-suspiciousness`` file is written instead
+    """
+    line_level = lines is not None
+    if not line_level:
+        lines = [[name] for name in element_names]
+    if top_k is not None:
+        order = top_elements(suspiciousnesses, top_k).tolist()
+        lines = [lines[element] for element in order]
+        suspiciousnesses = suspiciousnesses[order]
+    output_file, write_row = open_suspiciousness_file(output_dir, bug, formula, line_level=line_level)
+    with output_file:
+        for names, suspiciousness in zip(lines, suspiciousnesses.tolist()):
+            for name in names:
+                write_row(name, suspiciousness)
+
+
+def generate_suspiciousnesses(formulas, coverage_file, spectra_file, output_dir, tally_cache=None,
+                              collapse=False, prune=False, memory_budget=None, top_k=None, source_code_lines=None):
+    """
+    Generates the suspiciousness values of a bug for several formulas.
+
+    The coverage matrix is read and tallied once, and every formula is
+    scored from that single tally, writing one suspiciousness file per
+    formula.
+
+    Parameters
+    ----------
+    formulas : list
+        which formulas to use for computing suspiciousness
+    coverage_file : str
+        path to the coverage file
+    spectra_file : str
+        path to the spectra file
+    output_dir : str
+    tally_cache : str
+        directory of cached tallies, see ``load_tally``
+    collapse : bool
+        score each group of identical coverage columns once, see
+        ``load_tally``
+    prune : bool
+        score only the elements covered by a failing test in full, see
+        ``load_tally``. Applies to the formulas in ``PRUNABLE_FORMULAS``
+        only; if some formulas are not, the full tally is pruned for the
+        others with ``prune_tally``.
+    memory_budget : int
+        if given, process the bug in element ranges that fit this many
+        bytes with ``generate_suspiciousnesses_chunked`` instead, and
+        nothing is returned. It cannot be combined with ``tally_cache``,
+        ``collapse`` or ``prune``.
+    top_k : int
+        if given, write only the top_k most suspicious elements, see
+        ``write_suspiciousness``
+    source_code_lines : str
+        if given, the directory of the source-code.lines files, and line
+        suspiciousness files are written instead, see ``element_lines``
+
+    Returns
+    -------
+    dict
+        formula to the suspiciousness values for all lines
+    """
+    if memory_budget is not None:
+        if tally_cache is not None or collapse or prune:
+            raise ValueError('memory_budget cannot be combined with tally_cache, collapse or prune')
+        return generate_suspiciousnesses_chunked(formulas, coverage_file, spectra_file, output_dir, memory_budget,
+                                                 top_k=top_k, source_code_lines=source_code_lines)
+
+    prunable = set(formula for formula in formulas if prune and formula in PRUNABLE_FORMULAS)
+    element_names, tally, groups = load_tally(
+        coverage_file, spectra_file, 'tests', tally_cache=tally_cache, collapse=collapse,
+        prune=len(prunable) == len(formulas))
+    pruned_tally, pruned_groups = tally, groups
+    if prunable and len(prunable) < len(formulas):
+        pruned_tally, pruned_groups = prune_tally(tally)
+        if pruned_groups is None:
+            pruned_groups = groups
+        elif groups is not None:
+            # Map each element through its column group to the pruned group
+            pruned_groups = pruned_groups[groups]
+
+    bug = parse_bug_from_file_name(coverage_file)
+    lines = None
+    if source_code_lines is not None:
+        lines = element_lines(element_names, load_source_code(bug, source_code_lines))
+
+    suspiciousnesses = {}
+    for formula in formulas:
+        formula_tally, formula_groups = (pruned_tally, pruned_groups) if formula in prunable else (tally, groups)
+        suspiciousnesses[formula] = suspiciousness_array_from_tallies(
+            formula=formula, hybrid_scheme=None,
+            tally=formula_tally, hybrid_coverage_tally=None)
+        if formula_groups is not None:
+            suspiciousnesses[formula] = suspiciousnesses[formula][formula_groups]
+        write_suspiciousness(output_dir, bug, formula, element_names, suspiciousnesses[formula], top_k=top_k,
+                             lines=lines)
+
+    return suspiciousnesses
+
+
+def generate_suspiciousnesses_chunked(formulas, coverage_file, spectra_file, output_dir, memory_budget, top_k=None,
+                                      source_code_lines=None):
+    """
+    Generates the suspiciousness values of a bug for several formulas
+    without holding per-element data for the whole program in memory.
+
+    The elements are processed in contiguous ranges sized to fit
+    ``memory_budget``. For each range the matrix is streamed once and only
+    that block of columns is read from every row; the range is then scored
+    and appended to the output files before the next one is started.
+
+    Parameters
+    ----------
+    formulas : list
+        which formulas to use for computing suspiciousness
+    coverage_file : str
+        path to the coverage file, which must be a text GZoltar matrix
+    spectra_file : str
+        path to the spectra file
+    output_dir : str
+    memory_budget : int
+        approximate number of bytes of per-element data to hold at once
+    top_k : int
+        if given, keep only the top_k most suspicious elements seen so far
+        after each range and write them, most suspicious first, at the end
+    source_code_lines : str
+        if given, the directory of the source-code.lines files, and line
+        suspiciousness files are written instead, see ``element_lines``
+    """
+    if gzoltar.is_gzoltar_tarball(coverage_file) or gzoltar.is_packed_coverage(coverage_file):
+        raise ValueError('chunked processing needs a text coverage matrix, got {!r}'.format(coverage_file))
+
+    with open(spectra_file) as name_file:
+        n_elements = sum(1 for _ in name_file)
+    chunk = max(1, memory_budget // (CHUNK_ELEMENT_BYTES + 8 * len(formulas)))
+    bug = parse_bug_from_file_name(coverage_file)
+
+    source_code = None if source_code_lines is None else load_source_code(bug, source_code_lines)
+
+    output_files, writers = [], []
+    try:
+        for formula in formulas:
+            output_file, write_row = open_suspiciousness_file(output_dir, bug, formula, line_level=source_code is not None)
+            output_files.append(output_file)
+            writers.append(write_row)
+
+        totals = None
+        best = [(np.zeros(0, dtype=np.int64), [], np.zeros(0)) for _ in formulas]
+        with open(spectra_file) as name_file:
+            for start in range(0, n_elements, chunk):
+                stop = min(start + chunk, n_elements)
+                tally = tally_matrix_columns(coverage_file, 'tests', n_elements, start, stop)
+                if totals is None:
+                    totals = tally.totalpassed, tally.totalfailed
+                element_names = [name_file.readline().strip() for _ in range(stop - start)]
+                if source_code is None:
+                    lines = [[name] for name in element_names]
+                else:
+                    lines = element_lines(element_names, source_code)
+                for i, (formula, write_row) in enumerate(zip(formulas, writers)):
+                    suspiciousnesses = suspiciousness_array_from_tallies(
+                        formula=formula, hybrid_scheme=None,
+                        tally=tally, hybrid_coverage_tally=None)
+                    if top_k is None:
+                        for names, suspiciousness in zip(lines, suspiciousnesses.tolist()):
+                            for name in names:
+                                write_row(name, suspiciousness)
+                        continue
+                    # Merge the range into the best elements seen so far
+                    best_elements, best_lines, best_suspiciousnesses = best[i]
+                    elements = np.concatenate([best_elements, np.arange(start, stop)])
+                    candidate_lines = best_lines + lines
+                    suspiciousnesses = np.concatenate([best_suspiciousnesses, suspiciousnesses])
+                    order = top_elements(suspiciousnesses, top_k, elements)
+                    best[i] = elements[order], [candidate_lines[position] for position in order.tolist()], suspiciousnesses[order]
+
+        if top_k is not None:
+            for write_row, (_, best_lines, best_suspiciousnesses) in zip(writers, best):
+                for names, suspiciousness in zip(best_lines, best_suspiciousnesses.tolist()):
+                    for name in names:
+                        write_row(name, suspiciousness)
+    finally:
+        for output_file in output_files:
+            output_file.close()
+
+
+def generate_suspiciousness(formula, coverage_file, spectra_file, output_dir):
+    """
+    Generates the suspiciousness value for each bug in the dataset.
+
+    The method reads the coverage file and the spectra file, and uses 
+    the method given in the fault-localization-data to generate a value
+    between 0 and 1.
+
+    Parameters
+    ----------
+    formula : str
+        which formula to use for computing suspiciousness
+    coverage_file : str
+        path to the coverage file
+    spectra_file : str
+        path to the spectra file
+    output_dir : str
+
+    
+    Returns
+    -------
+    numpy.ndarray
+        suspiciousness value for all lines, indexed by element number
+    """
+    return generate_suspiciousnesses([formula], coverage_file, spectra_file, output_dir)[formula]
+
+
+def generate_mbfl_suspiciousnesses(formulas, kill_file, mutants_file, output_dir, mutant_coverage_file=None,
+                                   hybrid_scheme=None, aggregate='max', top_k=None, source_code_lines=None):
+    """
+    Generates mutation-based suspiciousness values of a bug for several
+    formulas.
+
+    The kill matrix (which tests kill which mutant) and, for the hybrid
+    schemes, the mutant coverage matrix (which tests cover which mutant)
+    are each tallied once. Every mutant is then scored at once with
+    ``crush_rows``, and mutant scores are aggregated per statement.
+
+    Parameters
+    ----------
+    formulas : list
+        which formulas to use for computing suspiciousness
+    kill_file : str
+        path to the kill matrix, in the coverage matrix format with one
+        column per mutant
+    mutants_file : str
+        path to the file naming the statement of each mutant, one per line
+        in kill matrix column order
+    output_dir : str
+    mutant_coverage_file : str
+        path to the mutant coverage matrix, needed by every hybrid scheme
+    hybrid_scheme : str
+        None, numerator, constant, mirror or coverage-only, see ``crush_row``
+    aggregate : str
+        "max" or "mean", how the scores of a statement's mutants combine
+    top_k : int
+        if given, write only the top_k most suspicious statements, see
+        ``write_suspiciousness``
+    source_code_lines : str
+        if given, the directory of the source-code.lines files, and line
+        suspiciousness files are written instead, see ``element_lines``
+
+    Returns
+    -------
+    dict
+        formula to the suspiciousness values, indexed by statement in order
+        of first appearance in ``mutants_file``
+    """
+    if hybrid_scheme == 'numerator':
+        unsupported = [formula for formula in formulas if formula not in VECTORIZED_HYBRID_NUMERATOR_FORMULAS]
+        if unsupported:
+            raise ValueError('no hybrid numerator form for formulas {!r}'.format(unsupported))
+
+    with open(mutants_file) as name_file:
+        mutant_statements = [name.strip() for name in name_file]
+    n_mutants = len(mutant_statements)
+
+    kill_tally = tally_coverage_file(kill_file, 'tests', n_mutants)
+    if hybrid_scheme is None:
+        coverage_tally = None
+    elif mutant_coverage_file is None:
+        raise ValueError('hybrid scheme {!r} needs a mutant coverage matrix'.format(hybrid_scheme))
+    else:
+        coverage_tally = tally_coverage_file(mutant_coverage_file, 'tests', n_mutants)
+
+    dictionary = s2l_suspiciousness.StatementDictionary()
+    mutant_statement = np.array([dictionary.add(statement) for statement in mutant_statements], dtype=np.int64)
+    statements = dictionary.statements
+
+    bug = parse_bug_from_file_name(kill_file)
+    lines = None
+    if source_code_lines is not None:
+        lines = element_lines(statements, load_source_code(bug, source_code_lines), dictionary)
+
+    suspiciousnesses = {}
+    for formula in formulas:
+        mutant_suspiciousnesses = suspiciousness_array_from_tallies(
+            formula=formula, hybrid_scheme=hybrid_scheme,
+            tally=kill_tally, hybrid_coverage_tally=coverage_tally).astype(np.float64)
+        suspiciousnesses[formula] = aggregate_mutants(mutant_suspiciousnesses, mutant_statement, len(statements), aggregate)
+        write_suspiciousness(output_dir, bug, '%s-mbfl' % formula, statements, suspiciousnesses[formula], top_k=top_k,
+                             lines=lines)
+
+    return suspiciousnesses
+
+
+def aggregate_mutants(mutant_suspiciousnesses, mutant_statement, n_statements, aggregate):
+    """
+    Aggregates mutant suspiciousness values up to their statements.
+
+    Parameters
+    ----------
+    mutant_suspiciousnesses : numpy.ndarray
+        the suspiciousness of every mutant
+    mutant_statement : numpy.ndarray
+        the statement number of every mutant
+    n_statements : int
+        the number of statements
+    aggregate : str
+        "max" or "mean"
+
+    Returns
+    -------
+    numpy.ndarray
+        the suspiciousness of every statement
+    """
+    if aggregate == 'max':
+        suspiciousnesses = np.full(n_statements, -np.inf)
+        np.maximum.at(suspiciousnesses, mutant_statement, mutant_suspiciousnesses)
+        return suspiciousnesses
+    elif aggregate == 'mean':
+        totals = np.bincount(mutant_statement, weights=mutant_suspiciousnesses, minlength=n_statements)
+        return totals / np.bincount(mutant_statement, minlength=n_statements)
+    raise ValueError('unrecognized aggregate: {!r}'.format(aggregate))
 
-if __name__ == '__main__':
-    # Slight hack to allow for 'all' as a choice
-    formula_choices = set(FORMULAS.keys())
-    formula_choices.add('all')
 
+def _generate_bug(job):
+    """
+    Pool worker for ``run_bugs``.
+
+    Returns
+    -------
+    tuple(str, str)
+        the bug and the error it failed with, or None if it succeeded
+    """
+    generate, inputs, options = job
+    bug = parse_bug_from_file_name(inputs[0][1])
+    try:
+        generate(**dict(inputs, **options))
+    except Exception as e:
+        return bug, '%s: %s' % (type(e).__name__, e)
+    return bug, None
+
+
+def _register_worker_formulas(definitions):
+    """
+    Pool initializer registering the formula expressions of the parent
+    process, in case the worker did not inherit them.
+    """
+    register_formulas({name: definition for name, definition in definitions.items() if name not in VECTORIZED_FORMULAS})
+
+
+def run_bugs(generate, bug_inputs, jobs=1, formula_definitions=None, **options):
+    """
+    Runs a per-bug generator over every bug, optionally fanning the bugs
+    out over a process pool.
+
+    The bugs with the largest input files are scheduled first so that the
+    big Closure bugs do not end up running alone at the end. A bug that
+    fails does not abort the run.
+
+    Parameters
+    ----------
+    generate : function
+        the per-bug generator, e.g. ``generate_suspiciousnesses``
+    bug_inputs : list
+        for every bug, a list of (argument name, path) pairs of its input
+        files; the first one names the bug
+    jobs : int
+        number of worker processes
+    formula_definitions : dict
+        formula expressions registered with ``register_formulas``, which
+        are registered again in every worker
+    options
+        further keyword arguments for ``generate``, shared by all bugs
+
+    Returns
+    -------
+    list
+        (bug, error) pairs for the bugs that failed
+    """
+    bug_jobs = sorted(
+        [(generate, inputs, options) for inputs in bug_inputs],
+        key=lambda job: sum(os.path.getsize(path) for path in set(path for _, path in job[1] if path is not None)),
+        reverse=True)
+
+    results = gzoltar.map_jobs(_generate_bug, bug_jobs, jobs,
+                               initializer=_register_worker_formulas, initargs=(formula_definitions or {},))
+
+    return sorted((bug, error) for bug, error in results if error is not None)
+
+
+def generate_all_suspiciousnesses(formulas, coverage_files, spectra_files, output_dir, jobs=1,
+                                  formula_definitions=None, **options):
+    """
+    Generates the suspiciousness values of every bug, see ``run_bugs``.
+
+    Parameters
+    ----------
+    formulas : list
+        which formulas to use for computing suspiciousness
+    coverage_files : list
+        paths to the coverage files
+    spectra_files : list
+        paths to the spectra files, in the same order as ``coverage_files``
+    output_dir : str
+    jobs : int
+        number of worker processes
+    formula_definitions : dict
+        see ``run_bugs``
+    options
+        further keyword arguments for ``generate_suspiciousnesses``
+
+    Returns
+    -------
+    list
+        (bug, error) pairs for the bugs that failed
+    """
+    bug_inputs = [[('coverage_file', coverage_file), ('spectra_file', spectra_file)]
+                  for coverage_file, spectra_file in zip(coverage_files, spectra_files)]
+    return run_bugs(generate_suspiciousnesses, bug_inputs, jobs=jobs, formula_definitions=formula_definitions,
+                    formulas=formulas, output_dir=output_dir, **options)
+
+
+def generate_all_mbfl_suspiciousnesses(formulas, kill_files, mutants_files, mutant_coverage_files, output_dir,
+                                       jobs=1, formula_definitions=None, **options):
+    """
+    Generates the mutation-based suspiciousness values of every bug, see
+    ``run_bugs``.
+
+    Parameters
+    ----------
+    formulas : list
+        which formulas to use for computing suspiciousness
+    kill_files : list
+        paths to the kill matrices
+    mutants_files : list
+        paths to the mutant statement files, in the same order
+    mutant_coverage_files : list
+        paths to the mutant coverage matrices in the same order, or None
+        when no hybrid scheme is used
+    output_dir : str
+    jobs : int
+        number of worker processes
+    formula_definitions : dict
+        see ``run_bugs``
+    options
+        further keyword arguments for ``generate_mbfl_suspiciousnesses``
+
+    Returns
+    -------
+    list
+        (bug, error) pairs for the bugs that failed
+    """
+    if mutant_coverage_files is None:
+        mutant_coverage_files = [None] * len(kill_files)
+    bug_inputs = [[('kill_file', kill_file), ('mutants_file', mutants_file), ('mutant_coverage_file', mutant_coverage_file)]
+                  for kill_file, mutants_file, mutant_coverage_file in zip(kill_files, mutants_files, mutant_coverage_files)]
+    return run_bugs(generate_mbfl_suspiciousnesses, bug_inputs, jobs=jobs, formula_definitions=formula_definitions,
+                    formulas=formulas, output_dir=output_dir, **options)
+
+
+if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--formula', required=True, choices=formula_choices, help='formula to use for suspiciousness calculation')
-    parser.add_argument('--data-dir', required=True, help='data directory that holds coverage and spectra files')
+    parser.add_argument('--formula', required=True, help='formula to use for suspiciousness calculation: all, %s or one defined with --define-formula/--formula-file' % ', '.join(sorted(FORMULAS)))
+    parser.add_argument('--data-dir', required=True, help='data directory that holds coverage and spectra files, or the Defects4J <project>/<bug>/%s layout' % gzoltar.TAR_FILE)
     parser.add_argument('--output-dir', required=True, help='file to write suspiciousness vector to')
+    parser.add_argument('--jobs', type=int, default=1, help='number of bugs to process in parallel')
+    parser.add_argument('--collapse-columns', action='store_true', help='score statements with identical coverage columns once per group')
+    parser.add_argument('--prune', action='store_true', help='only score statements covered by a failing test in full (%s only)' % ', '.join(sorted(PRUNABLE_FORMULAS)))
+    parser.add_argument('--memory-budget', type=int, help='process each bug in element ranges that fit this many MB of memory, for matrices too large to tally at once')
+    parser.add_argument('--tally-cache', help='directory to cache coverage tallies in, keyed by the content hash of the coverage and spectra files')
+    parser.add_argument('--define-formula', nargs=3, action='append', default=[], metavar=('NAME', 'EXPRESSION', 'FALLBACK'),
+                        help='define a formula as an expression over passed, failed, totalpassed and totalfailed, with the value to use where it divides by zero')
+    parser.add_argument('--formula-file', help='JSON file of formula definitions, {"name": {"expression": ..., "fallback": ...}}')
+    parser.add_argument('--top-k', type=int, help='write only the K most suspicious statements of each bug, most suspicious first')
+    parser.add_argument('--source-code-lines', help='directory of the <project>-<bug>b.source-code.lines files, to write line suspiciousness files directly instead of statement ones')
+    parser.add_argument('--mbfl', action='store_true', help='score mutants from the <bug>-killmatrix, <bug>-mutants and <bug>-mutantcoverage files in the data directory and aggregate them to statements')
+    parser.add_argument('--hybrid-scheme', choices=HYBRID_SCHEMES, help='hybrid scheme combining kill and coverage tallies, for --mbfl')
+    parser.add_argument('--aggregate', choices=['max', 'mean'], help='how mutant scores combine per statement, for --mbfl (default: max)')
 
     args = parser.parse_args()
 
-    coverage_files = sorted(glob(os.path.join(args.data_dir, '*coverage')))
-    spectra_files = sorted(glob(os.path.join(args.data_dir, '*spectra')))
+    formula_definitions = load_formula_file(args.formula_file) if args.formula_file else {}
+    formula_definitions.update((name, (expression, fallback)) for name, expression, fallback in args.define_formula)
+    try:
+        register_formulas(formula_definitions)
+    except (SyntaxError, ValueError) as e:
+        parser.error(str(e))
+    if args.formula != 'all' and args.formula not in VECTORIZED_FORMULAS:
+        parser.error('unknown formula {!r}'.format(args.formula))
+    if args.top_k is not None and args.top_k < 1:
+        parser.error('--top-k must be positive')
+    if args.memory_budget is not None:
+        if args.memory_budget < 1:
+            parser.error('--memory-budget must be positive')
+        for flag, value in [('--prune', args.prune), ('--collapse-columns', args.collapse_columns),
+                            ('--tally-cache', args.tally_cache is not None), ('--mbfl', args.mbfl)]:
+            if value:
+                parser.error('--memory-budget cannot be combined with %s' % flag)
+    if args.mbfl:
+        for flag, value in [('--prune', args.prune), ('--collapse-columns', args.collapse_columns),
+                            ('--tally-cache', args.tally_cache is not None)]:
+            if value:
+                parser.error('--mbfl cannot be combined with %s' % flag)
+    else:
+        for flag, value in [('--hybrid-scheme', args.hybrid_scheme is not None), ('--aggregate', args.aggregate is not None)]:
+            if value:
+                parser.error('%s requires --mbfl' % flag)
+
+    # With 'all', each bug is tallied once and scored with every formula
+    formulas = list(VECTORIZED_FORMULAS.keys()) if args.formula == 'all' else [args.formula]
+
+    if args.prune:
+        unprunable = [formula for formula in formulas if formula not in PRUNABLE_FORMULAS]
+        if unprunable and args.formula != 'all':
+            parser.error('--prune does not apply to formula {!r}'.format(args.formula))
+        if unprunable:
+            eprint('Not pruning formulas --prune does not apply to: %s' % ', '.join(unprunable))
+
+    if args.mbfl:
+        if args.hybrid_scheme == 'numerator':
+            # Formulas defined as expressions have no hybrid numerator form
+            unsupported = [formula for formula in formulas if formula not in VECTORIZED_HYBRID_NUMERATOR_FORMULAS]
+            if unsupported and args.formula != 'all':
+                parser.error('formula {!r} has no hybrid numerator form'.format(args.formula))
+            if unsupported:
+                eprint('Skipping formulas without a hybrid numerator form: %s' % ', '.join(unsupported))
+                formulas = [formula for formula in formulas if formula not in unsupported]
+        kill_files = sorted(glob(os.path.join(args.data_dir, '*-killmatrix')))
+        mutants_files = sorted(glob(os.path.join(args.data_dir, '*-mutants')))
+        mutant_coverage_files = sorted(glob(os.path.join(args.data_dir, '*-mutantcoverage'))) if args.hybrid_scheme else None
+        if len(kill_files) != len(mutants_files) or (mutant_coverage_files is not None and len(kill_files) != len(mutant_coverage_files)):
+            eprint('Number of kill matrices is not equal to the number of mutants or mutant coverage files')
+            sys.exit(-1)
+        failures = generate_all_mbfl_suspiciousnesses(
+            formulas, kill_files, mutants_files, mutant_coverage_files, args.output_dir, jobs=args.jobs,
+            formula_definitions=formula_definitions, hybrid_scheme=args.hybrid_scheme, aggregate=args.aggregate or 'max',
+            top_k=args.top_k, source_code_lines=args.source_code_lines)
+        for bug, error in failures:
+            eprint('Could not generate suspiciousness for %s: %s' % (bug, error))
+        sys.exit(-1 if failures else 0)
+
+    coverage_files = sorted(glob(os.path.join(args.data_dir, '*-coverage')))
+    spectra_files = sorted(glob(os.path.join(args.data_dir, '*-spectra')))
+    if not coverage_files and not spectra_files:
+        # Read the matrix and spectra straight out of the original tarballs
+        coverage_files = spectra_files = sorted(glob(os.path.join(args.data_dir, '*', '*', gzoltar.TAR_FILE)))
 
     if len(coverage_files) != len(spectra_files):
         eprint('Number of coverage files is not equal to the number of spectra files')
         sys.exit(-1)
-    
-    if args.formula == 'all':
-        for formula in FORMULAS.keys():
-            for coverage_file, spectra_file in zip(coverage_files, spectra_files):
-                generate_suspiciousness(formula, coverage_file, spectra_file, args.output_dir)
-    else:
-        for coverage_file, spectra_file in zip(coverage_files, spectra_files):
-            generate_suspiciousness(args.formula, coverage_file, spectra_file, args.output_dir)
\ No newline at end of file
+
+    failures = generate_all_suspiciousnesses(
+        formulas, coverage_files, spectra_files, args.output_dir, jobs=args.jobs,
+        formula_definitions=formula_definitions,
+        tally_cache=args.tally_cache, collapse=args.collapse_columns, prune=args.prune,
+        memory_budget=args.memory_budget * 2**20 if args.memory_budget is not None else None,
+        top_k=args.top_k, source_code_lines=args.source_code_lines)
+
+    for bug, error in failures:
+        eprint('Could not generate suspiciousness for %s: %s' % (bug, error))
+    if failures:
+        sys.exit(-1)